@@ -0,0 +1,326 @@
+# Headless benchmark for the outputs of retail_store_dashboard.py. It generates
+# synthetic sales CSVs with the retail_store_sales.csv schema, runs the dashboard's
+# server() with stand-in input, output and session objects, and times every output
+# for every Category_filter value. Results are printed and saved as JSON, and can be
+# compared against a previous run:
+#
+#   python retail_store_benchmark.py --rows 10000 1000000 --output bench.json
+#   python retail_store_benchmark.py --rows 10000 1000000 --compare bench.json
+from htmltools import TagList
+from shiny import reactive
+from shiny.module import ResolvedId
+from shiny.session import session_context
+import pandas as pd
+import numpy as np
+import argparse
+import asyncio
+import datetime
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+outputs = [
+    "stacked_bar_chart", "price", "quantity", "yoy", "top_customers",
+    "donut_chart", "bar_chart_avg_price", "bar_chart_month", "bar_chart_day",
+]
+
+#-------- Synthetic data --------#
+
+# Same categories, item codes, prices and share of missing values as the sample CSV
+categories = {
+    'Beverages': 'BEV',
+    'Butchers': 'BUT',
+    'Computers and electric accessories': 'CEA',
+    'Electric household essentials': 'EHE',
+    'Food': 'FOOD',
+    'Furniture': 'FUR',
+    'Milk Products': 'MILK',
+    'Patisserie': 'PAT',
+}
+items_per_category = 25
+payment_methods = ['Cash', 'Credit Card', 'Digital Wallet']
+locations = ['Online', 'In-store']
+first_day, last_day = np.datetime64('2022-01-01'), np.datetime64('2025-01-18')
+
+def generate_chunk(rng, start, rows, customers):
+    category_codes = rng.integers(0, len(categories), rows)
+    item_numbers = rng.integers(1, items_per_category + 1, rows)
+    price = 5.0 + 1.5 * (item_numbers - 1)
+    quantity = rng.integers(1, 11, rows).astype(float)
+    dates = first_day + rng.integers(0, (last_day - first_day).astype(int) + 1, rows)
+
+    abbreviations = np.array(list(categories.values()))[category_codes]
+    item = pd.Series([f"Item_{n}_{a}" for n, a in zip(item_numbers, abbreviations)], dtype=object)
+    item[rng.random(rows) < 0.096] = None
+    price[rng.random(rows) < 0.048] = np.nan
+    no_quantity = rng.random(rows) < 0.048
+    quantity[no_quantity] = np.nan
+    discount = pd.Series(rng.choice([True, False], rows), dtype=object)
+    discount[rng.random(rows) < 1 / 3] = None
+
+    return pd.DataFrame({
+        'Transaction ID': [f"TXN_{n:07d}" for n in range(start, start + rows)],
+        'Customer ID': [f"CUST_{n:02d}" for n in rng.integers(1, customers + 1, rows)],
+        'Category': np.array(list(categories))[category_codes],
+        'Item': item,
+        'Price Per Unit': price,
+        'Quantity': quantity,
+        'Total Spent': np.where(no_quantity, np.nan, price * quantity),
+        'Payment Method': np.array(payment_methods)[rng.integers(0, len(payment_methods), rows)],
+        'Location': np.array(locations)[rng.integers(0, len(locations), rows)],
+        'Transaction Date': pd.to_datetime(dates).strftime('%Y-%m-%d'),
+        'Discount Applied': discount,
+    })
+
+def generate_transactions(path, rows, customers=25, seed=0, chunk_rows=1_000_000):
+    # Written in chunks, so 10M rows need no more memory than 1M
+    rng = np.random.default_rng(seed)
+    with open(path, 'w', newline='') as f:
+        for start in range(0, rows, chunk_rows):
+            chunk = generate_chunk(rng, start, min(chunk_rows, rows - start), customers)
+            chunk.to_csv(f, header=start == 0, index=False)
+
+def synthetic_csv(directory, rows, customers, seed):
+    path = os.path.join(directory, f"retail_store_sales_{rows}_{customers}_{seed}.csv")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        generate_transactions(path + ".tmp", rows, customers, seed)
+        os.replace(path + ".tmp", path)
+    return path
+
+#-------- Stand-in session --------#
+
+class StubInput:
+    def __init__(self, Category_filter):
+        self.Category_filter = reactive.value(Category_filter)
+        self.Date_range = reactive.value(None)  # Every day
+        self.Location_filter = reactive.value("All")
+
+class StubOutput:
+    # Used as the @output decorator: keeps every renderer by output name
+    def __init__(self):
+        self.renderers = {}
+
+    def __call__(self, renderer):
+        self.renderers[renderer.output_id] = renderer
+        return renderer
+
+class StubClientData:
+    def __init__(self, width, height, pixelratio):
+        self.width, self.height, self.ratio = width, height, pixelratio
+
+    def output_width(self, id=None):
+        return self.width
+
+    def output_height(self, id=None):
+        return self.height
+
+    def pixelratio(self):
+        return self.ratio
+
+class StubSession:
+    # Only what server() and the renderers use: outputs without @output register
+    # themselves on the current session, and reactives hook its lifecycle
+    ns = ResolvedId("")  # The app's root namespace
+    id = "benchmark"
+
+    def __init__(self, width, height, pixelratio):
+        self.clientdata = StubClientData(width, height, pixelratio)
+        self.output = StubOutput()
+
+    def on_ended(self, callback):
+        return lambda: None
+
+    def on_destroy(self, callback):
+        return lambda: None
+
+    # Effects report to their session while they are pending
+    def _increment_busy_count(self):
+        pass
+
+    def _decrement_busy_count(self):
+        pass
+
+    # render.ui turns its value into HTML through the session
+    def _process_ui(self, ui):
+        rendered = TagList(ui).render()
+        return {"deps": [dep.as_dict() for dep in rendered["dependencies"]], "html": rendered["html"]}
+
+#-------- Measurements --------#
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports KiB
+
+def summarize(seconds):
+    ms = np.array(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+async def render_once(renderer):
+    with reactive.isolate():
+        return await renderer.render()
+
+async def measure_outputs(dashboard, args):
+    input = StubInput("All")
+    session = StubSession(args.width, args.height, args.pixelratio)
+    filters = list(dashboard.dataset.views)
+
+    seconds = {name: [] for name in outputs}
+    results = {name: {"filters": {}} for name in outputs}
+    with session_context(session):
+        dashboard.server(input, session.output, session)
+        for selected in filters:
+            input.Category_filter.set(selected)
+            await reactive.flush()  # Runs the effect that resolves the filtered view
+
+            for name in outputs:
+                renderer = session.output.renderers[name]
+                timings = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    await render_once(renderer)
+                    timings.append(time.perf_counter() - start)
+                seconds[name] += timings
+
+                # A separate, traced render, since tracing slows down the timed ones
+                tracemalloc.start()
+                await render_once(renderer)
+                results[name]["filters"][selected] = {
+                    **summarize(timings),
+                    "peak_alloc_bytes": tracemalloc.get_traced_memory()[1],
+                }
+                tracemalloc.stop()
+
+    for name in outputs:
+        results[name]["overall"] = {
+            **summarize(seconds[name]),
+            "peak_alloc_bytes": max(s["peak_alloc_bytes"] for s in results[name]["filters"].values()),
+        }
+    return results
+
+def run_dataset(args):
+    # Runs in its own process (see main), so the dashboard loads this CSV at import
+    # and peak RSS only covers this dataset
+    os.environ["RETAIL_SALES_CSV"] = args.csv
+    os.environ["RETAIL_FILTER_DEBOUNCE_MS"] = "0"  # Filter changes apply on the next flush
+    if args.cold:
+        os.environ["RETAIL_PLOT_CACHE_MB"] = "0"  # Every plot render is a cache miss
+
+    start = time.perf_counter()
+    dashboard = importlib.import_module("retail_store_dashboard")
+    load_seconds = time.perf_counter() - start
+    load_rss = peak_rss_bytes()
+
+    results = asyncio.run(measure_outputs(dashboard, args))
+    return {
+        "csv": args.csv,
+        "rows": int(dashboard.dataset.cube['Transactions'].sum()),
+        "load_seconds": load_seconds,
+        "load_peak_rss_bytes": load_rss,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "outputs": results,
+    }
+
+#-------- Reports --------#
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "time": datetime.datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+    }
+
+def print_dataset(result, baseline=None):
+    rss = result["peak_rss_bytes"]
+    print(f"\n{result['rows']:,} rows: load {result['load_seconds']:.2f}s"
+          + (f", peak RSS {rss / 2**20:,.0f} MB" if rss else ""))
+    print(f"  {'output':<20} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'alloc KB':>9}"
+          + (f" {'p50 vs base':>12}" if baseline else ""))
+    for name, stats in result["outputs"].items():
+        overall = stats["overall"]
+        line = (f"  {name:<20} {overall['p50_ms']:>9.2f} {overall['p90_ms']:>9.2f} "
+                f"{overall['p99_ms']:>9.2f} {overall['peak_alloc_bytes'] / 1024:>9.0f}")
+        if baseline and name in baseline["outputs"]:
+            line += f" {overall['p50_ms'] / baseline['outputs'][name]['overall']['p50_ms']:>11.2f}x"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every output of the retail store dashboard")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="synthetic dataset sizes (10k to 10M rows)")
+    parser.add_argument("--csv", help="benchmark this CSV instead of synthetic data")
+    parser.add_argument("--customers", type=int, default=25, help="distinct customers in synthetic data")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default="benchmark_data", help="where synthetic CSVs are kept")
+    parser.add_argument("--repeat", type=int, default=20, help="timed renders per output and filter")
+    parser.add_argument("--width", type=int, default=600)
+    parser.add_argument("--height", type=int, default=400)
+    parser.add_argument("--pixelratio", type=float, default=1)
+    parser.add_argument("--cold", action="store_true", help="disable the plot cache")
+    parser.add_argument("--output", help="save results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        json.dump(run_dataset(args), sys.stdout)
+        return
+
+    baselines = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baselines = {dataset["rows"]: dataset for dataset in json.load(f)["datasets"]}
+
+    paths = [args.csv] if args.csv else [
+        synthetic_csv(args.data_dir, rows, args.customers, args.seed) for rows in args.rows
+    ]
+    report = {"environment": environment(), "settings": vars(args), "datasets": []}
+    for path in paths:
+        # One process per dataset: the dashboard loads its data at import
+        child = [sys.executable, os.path.abspath(__file__), "--child", "--csv", path]
+        for option in ("repeat", "width", "height", "pixelratio"):
+            child += [f"--{option}", str(getattr(args, option))]
+        if args.cold:
+            child.append("--cold")
+        completed = subprocess.run(child, capture_output=True, text=True)
+        if completed.returncode:
+            sys.exit(f"Benchmark of {path} failed:\n{completed.stderr}")
+        result = json.loads(completed.stdout)
+        report["datasets"].append(result)
+        print_dataset(result, baselines.get(result["rows"]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
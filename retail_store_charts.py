@@ -0,0 +1,541 @@
+# Chart drawing for retail_store_dashboard.py. Each chart is drawn from small, already
+# aggregated inputs, and this module only depends on matplotlib, so plot worker
+# processes can import it without loading the dataset.
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import atexit
+import base64
+import html
+import io
+import math
+import threading
+import time
+
+# Define a consistent color palette
+color_palette = ['#4E79A7', '#F28E2C', '#E15759', '#76B7B2', '#59A14F', '#EDC949']
+
+#-------- Figure templates --------#
+
+# Every chart keeps one Figure per process, created outside pyplot's figure registry.
+# The first render builds the static parts (titles, spines, legends, empty bars) and
+# later renders only update bar heights, colors, labels and limits on those artists.
+class ChartTemplate:
+    def __init__(self):
+        self.figure = Figure()
+        FigureCanvasAgg(self.figure)
+        self.figure.set_layout_engine('tight')
+        self.ax = self.figure.subplots()
+        self.artists = {}
+        self.lock = threading.Lock()
+
+templates = {}
+templates_lock = threading.Lock()
+
+def get_template(draw):
+    with templates_lock:
+        template = templates.get(draw)
+        if template is None:
+            template = templates[draw] = ChartTemplate()
+        return template
+
+def release_templates():
+    # Drop every template and the artists it holds; called when the app shuts down, and
+    # by plot worker processes as they exit
+    with templates_lock:
+        for template in templates.values():
+            template.figure.clear()
+        templates.clear()
+
+def init_plot_worker():
+    # Initializer of the plot worker processes
+    atexit.register(release_templates)
+
+def reset_template(template):
+    template.ax.clear()
+    template.artists.clear()
+
+def update_bars(template, labels, heights, colors, width=0.8, label_fontsize=8):
+    # Bars and their value labels are only recreated when the number of bars changes
+    ax = template.ax
+    bars = template.artists.get('bars')
+    if bars is None or len(bars) != len(heights):
+        if bars is not None:
+            bars.remove()
+            for text in template.artists['bar_labels']:
+                text.remove()
+        bars = ax.bar(range(len(heights)), [0] * len(heights), width=width)
+        template.artists['bars'] = bars
+        template.artists['bar_labels'] = [
+            ax.text(0, 0, "", ha='center', va='bottom', fontsize=label_fontsize)
+            for _ in bars
+        ]
+
+    for bar, height, color in zip(bars, heights, colors):
+        bar.set_height(height)
+        bar.set_color(color)
+    ax.set_xticks(range(len(labels)), labels)
+    return bars, template.artists['bar_labels']
+
+def show_message(template, message):
+    # Placeholder text for charts without data; hides the bars until data comes back
+    text = template.artists.get('message')
+    if text is None:
+        text = template.artists['message'] = template.ax.text(
+            0.5, 0.5, "", ha="center", va="center", fontsize=12, transform=template.ax.transAxes
+        )
+    text.set_text(message or "")
+    text.set_visible(message is not None)
+    for artist in template.artists.get('bars', []):
+        artist.set_visible(message is None)
+    for artist in template.artists.get('bar_labels', []):
+        artist.set_visible(message is None)
+    if message is not None:
+        template.ax.set_xticks([])
+
+def draw_stacked_bar_chart(template, data):
+    ax = template.ax
+    if data.empty:
+        # Nothing in the selected dates or location; the next data rebuilds the chart
+        reset_template(template)
+        show_message(template, "No data available")
+        return
+    layout = (tuple(data.index), tuple(data.columns))
+
+    # One bar container per payment method; rebuilt when categories or methods change
+    if template.artists.get('layout') != layout:
+        reset_template(template)
+        template.artists['layout'] = layout
+        template.artists['stacks'] = [
+            ax.bar(range(len(data.index)), [0] * len(data.index), width=0.5, label=method, color=color)
+            for method, color in zip(data.columns, color_palette)
+        ]
+
+        ax.set_ylabel("Total Spent", fontsize=14)
+        ax.set_xlabel("")  # Remove x-axis label
+        # ax.legend(title="Payment Method", fontsize=10)
+
+        # Move the legend outside the plot area
+        ax.legend(
+            title="Payment Method",
+            fontsize=10,
+            bbox_to_anchor=(1.05, 0.5),  # Move legend outside to the right
+            loc='center left',          # Anchor point for the legend
+            borderaxespad=0.           # Padding between legend and axes
+        )
+        ax.tick_params(axis='x', labelrotation=45)
+
+        # Wrap long x-axis labels
+        ax.set_xticks(range(len(data.index)), ["\n".join(str(label).split()) for label in data.index])
+        ax.set_xlim(-0.5, len(data.index) - 0.5)
+
+        ax.grid(axis='y', linestyle='--', alpha=0.7)
+
+        # Remove the right and top spines
+        ax.spines['right'].set_visible(False)
+        ax.spines['top'].set_visible(False)
+
+    # Stack each payment method on top of the previous ones
+    bottoms = [0.0] * len(data.index)
+    for stack, method in zip(template.artists['stacks'], data.columns):
+        for i, (bar, height) in enumerate(zip(stack, data[method])):
+            bar.set_y(bottoms[i])
+            bar.set_height(height)
+            bottoms[i] += height
+    ax.relim()
+    ax.autoscale_view()
+
+def draw_donut_chart(template, counts, selected_category):
+    # Wedge geometry and label placement depend on every share, so the pie is redrawn
+    # on the reused axes instead of being updated in place
+    ax = template.ax
+    reset_template(template)
+
+    if counts.empty:
+        ax.text(0.5, 0.5, "No data available", ha="center", va="center", fontsize=12)
+        ax.set_title("Category Distribution", fontsize=14)
+        return
+
+    wedges, texts, autotexts = ax.pie(
+        counts,
+        labels=["\n".join(str(label).split()) for label in counts.index],  # Wrap text
+        autopct='%1.1f%%',
+        startangle=90,
+        wedgeprops={'width': 0.8},
+        colors=color_palette[:len(counts)],
+    )
+    for text in texts + autotexts:
+        text.set_fontsize(12)  # Consistent font size for labels and percentages
+    title = "Category Distribution" if selected_category == "All" else f"Category Distribution: {selected_category}"
+    ax.set_title(title, fontsize=14)  # Consistent title font size
+
+def draw_bar_chart_avg_price(template, category_avg_price_sorted):
+    ax = template.ax
+    if not template.artists:
+        # Remove the right and top spines
+        ax.spines['right'].set_visible(False)
+        ax.spines['top'].set_visible(False)
+
+        # Chart details
+        ax.set_title('Average Price Per Unit by Category', fontsize=14, pad=20)  # Consistent title font size
+        ax.set_ylabel('Average Price Per Unit', fontsize=12)  # Consistent y-axis label font size
+        ax.tick_params(axis='y', labelsize=12)  # Consistent y-axis tick label font size
+
+    if category_avg_price_sorted.empty:
+        show_message(template, "No data available")
+        return
+
+    # Find the category with the highest value
+    max_value_category = category_avg_price_sorted.iloc[0]['Category']
+
+    # Highlight the highest value bar, wrapping long x-axis labels
+    wrapped_labels = ["\n".join(str(label).split()) for label in category_avg_price_sorted['Category']]
+    bars, bar_labels = update_bars(
+        template,
+        wrapped_labels,
+        category_avg_price_sorted['Average Price Per Unit'],
+        [
+            'orange' if category == max_value_category else 'teal'
+            for category in category_avg_price_sorted['Category']
+        ],
+        width=0.5,
+        label_fontsize=10,  # Consistent font size for bar labels
+    )
+    show_message(template, None)
+    ax.set_xticks(range(len(wrapped_labels)), wrapped_labels, rotation=45, ha='right', fontsize=12)  # Consistent font size for x-axis labels
+
+    # Add labels to each bar
+    for bar, text in zip(bars, bar_labels):
+        height = bar.get_height()
+        text.set_position((bar.get_x() + bar.get_width() / 2, height))  # Center of the bar
+        text.set_text(f"{height:.2f}")  # Display the value formatted to 2 decimal places
+
+    ax.relim()
+    ax.autoscale_view()
+
+def draw_bar_chart_month(template, month_total_spent, shared_max):
+    ax = template.ax
+    if not template.artists:
+        # Chart details
+        ax.set_title('Total Spent by Month', fontsize=14)  # Consistent title font size
+        ax.set_ylabel('Total Spent', fontsize=12)  # Consistent y-axis label font size
+        ax.tick_params(axis='x', labelrotation=45, labelsize=12)  # Consistent x-axis tick label font size
+        ax.tick_params(axis='y', labelsize=12)  # Consistent y-axis tick label font size
+
+        # Remove the right and top spines
+        ax.spines['right'].set_visible(False)
+        ax.spines['top'].set_visible(False)
+
+    if month_total_spent.empty:
+        show_message(template, "No data available")
+        return
+
+    # Find the month with the maximum total spent
+    max_value_month = month_total_spent.loc[month_total_spent['Total Spent'].idxmax(), 'Month Name']
+
+    bars, bar_labels = update_bars(
+        template,
+        month_total_spent['Month Name'],
+        month_total_spent['Total Spent'],
+        [
+            'orange' if month == max_value_month else '#48A6A7'
+            for month in month_total_spent['Month Name']
+        ],
+    )
+    show_message(template, None)
+
+    # Add labels to each bar
+    for bar, text in zip(bars, bar_labels):
+        height = bar.get_height()
+        text.set_position((
+            bar.get_x() + bar.get_width() / 2,  # Position at the center of the bar
+            height + (shared_max * 0.02),  # Move label slightly above the bar
+        ))
+        text.set_text(f"{height:,.0f}")  # Display the value formatted with commas
+
+    # Set the y-axis limit using the shared maximum
+    ax.set_xlim(-0.5, len(bars) - 0.5)
+    ax.set_ylim(0, shared_max * 1.15)  # Add extra padding for labels
+
+def draw_bar_chart_day(template, day_total_spent, shared_max):
+    ax = template.ax
+    if not template.artists:
+        # Chart details
+        ax.set_title('Total Spent by Day of the Week', fontsize=14, pad=20)  # Consistent title font size
+        ax.set_ylabel('Total Spent', fontsize=12)  # Consistent y-axis label font size
+        ax.tick_params(axis='x', labelrotation=45, labelsize=12)  # Consistent x-axis tick label font size
+        ax.tick_params(axis='y', labelsize=12)  # Consistent y-axis tick label font size
+
+        # Remove the right and top spines
+        ax.spines['right'].set_visible(False)
+        ax.spines['top'].set_visible(False)
+
+    if day_total_spent.empty:
+        show_message(template, "No data available")
+        return
+
+    # Find the day with the maximum total spent
+    max_value_day = day_total_spent.loc[day_total_spent['Total Spent'].idxmax(), 'Day Name']
+
+    bars, bar_labels = update_bars(
+        template,
+        day_total_spent['Day Name'],
+        day_total_spent['Total Spent'],
+        [
+            'orange' if day == max_value_day else '#9ACBD0'
+            for day in day_total_spent['Day Name']
+        ],
+        width=0.5,
+    )
+    show_message(template, None)
+
+    # Add labels to each bar
+    for bar, text in zip(bars, bar_labels):
+        height = bar.get_height()
+        text.set_position((bar.get_x() + bar.get_width() / 2, height))
+        text.set_text(f"{height:,.0f}")
+
+    # Set the y-axis limit using the shared maximum
+    ax.set_xlim(-0.5, len(bars) - 0.5)
+    ax.set_ylim(0, shared_max * 1.1)  # Add 10% padding
+
+def render_png(fig, width, height, pixelratio):
+    # Same sizing as render.plot: fill the output container at the device pixel ratio
+    dpi = fig.get_dpi()
+    fig.set_size_inches(width / dpi, height / dpi)
+    with io.BytesIO() as buf:
+        fig.savefig(buf, format='png', dpi=dpi * pixelratio)
+        data = base64.b64encode(buf.getvalue()).decode('utf-8')
+    return {"src": "data:image/png;base64," + data, "width": "100%", "height": "100%"}
+
+def render_plot(draw, args, width, height, pixelratio):
+    # Update the chart's template and encode it in one call, so a worker process can
+    # do both; the lock keeps concurrent renders of one chart from interleaving.
+    # Returns the image and the seconds spent drawing and rasterizing/encoding it.
+    template = get_template(draw)
+    with template.lock:
+        start = time.perf_counter()
+        draw(template, *args)
+        drawn = time.perf_counter()
+        image = render_png(template.figure, width, height, pixelratio)
+    return image, {"draw": drawn - start, "encode": time.perf_counter() - drawn}
+
+#-------- SVG charts --------#
+
+# The same charts written directly as small SVG documents from the aggregated series
+# (RETAIL_CHART_MODE=svg). Drawing them is string formatting instead of a matplotlib
+# render, the payload is a few KB instead of a PNG, and the browser scales them, so
+# resizing an output needs no new render.
+svg_width, svg_height = 600, 400
+svg_font = "font-family:sans-serif"
+
+def svg_document(body, title=None):
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {svg_width} {svg_height}" '
+        f'style="width:100%;height:400px;{svg_font}" preserveAspectRatio="xMidYMid meet">'
+    ]
+    if title:
+        parts.append(svg_text(svg_width / 2, 24, title, size=14))
+    parts += body
+    parts.append('</svg>')
+    return "".join(parts)
+
+def svg_text(x, y, text, size=12, anchor="middle", rotate=None, stack_up=False, **attrs):
+    # Multi-line labels (wrapped with "\n", like the PNG charts) become tspans; with
+    # stack_up the last line, rather than the first, sits at y
+    lines = str(text).split("\n")
+    transform = f' transform="rotate({rotate} {x:.1f} {y:.1f})"' if rotate else ""
+    extra = "".join(f' {name.replace("_", "-")}="{value}"' for name, value in attrs.items())
+    first_dy = -1.1 * (len(lines) - 1) if stack_up else 0
+    spans = "".join(
+        f'<tspan x="{x:.1f}" dy="{first_dy if i == 0 else 1.1:g}em">{html.escape(line)}</tspan>'
+        for i, line in enumerate(lines)
+    )
+    return f'<text x="{x:.1f}" y="{y:.1f}" font-size="{size}" text-anchor="{anchor}"{transform}{extra}>{spans}</text>'
+
+def svg_message(message, title=None):
+    return svg_document([svg_text(svg_width / 2, svg_height / 2, message)], title)
+
+def nice_ticks(top, count=5):
+    # Round tick values (1, 2 or 5 times a power of ten) from 0 up to at least top
+    if not top > 0:
+        return [0, 1]
+    raw = top / count
+    magnitude = 10 ** math.floor(math.log10(raw))
+    step = next(m * magnitude for m in (1, 2, 5, 10) if m * magnitude >= raw)
+    return [step * i for i in range(int(math.ceil(top / step)) + 1)]
+
+class SvgPlot:
+    # Plot area inside the margins, with a linear y scale from 0 to y_max
+    def __init__(self, y_max, left=80, right=20, top=45, bottom=95):
+        self.left, self.right = left, svg_width - right
+        self.top, self.bottom = top, svg_height - bottom
+        self.y_max = y_max if y_max > 0 else 1
+
+    def y(self, value):
+        return self.bottom - (self.bottom - self.top) * value / self.y_max
+
+    def slot(self, i, n):
+        # Center of the i-th of n evenly spaced bar positions
+        width = (self.right - self.left) / n
+        return self.left + width * (i + 0.5), width
+
+    def axes(self, ylabel, ticks, grid=False):
+        parts = []
+        for tick in ticks:
+            if tick > self.y_max:
+                break
+            y = self.y(tick)
+            if grid:
+                parts.append(f'<line x1="{self.left}" x2="{self.right}" y1="{y:.1f}" y2="{y:.1f}" '
+                             'stroke="#ccc" stroke-dasharray="4 3"/>')
+            parts.append(svg_text(self.left - 6, y + 4, f"{tick:,.0f}" if tick >= 10 else f"{tick:g}", size=11, anchor="end"))
+        parts.append(f'<line x1="{self.left}" x2="{self.left}" y1="{self.top}" y2="{self.bottom}" stroke="#000"/>')
+        parts.append(f'<line x1="{self.left}" x2="{self.right}" y1="{self.bottom}" y2="{self.bottom}" stroke="#000"/>')
+        parts.append(svg_text(18, (self.top + self.bottom) / 2, ylabel, size=12, rotate=-90))
+        return parts
+
+    def xlabels(self, labels, size=11):
+        parts = []
+        for i, label in enumerate(labels):
+            x, _ = self.slot(i, len(labels))
+            # Rotated like the PNG charts' tick labels, ending just below the tick
+            parts.append(svg_text(x + 4, self.bottom + 14, label, size=size, anchor="end", rotate=-45, stack_up=True))
+        return parts
+
+def svg_bars(plot, heights, colors, width=0.8, label_format=None, label_offset=0.0, label_size=8):
+    parts = []
+    for i, (height, color) in enumerate(zip(heights, colors)):
+        x, slot_width = plot.slot(i, len(heights))
+        bar_width = slot_width * width
+        y = plot.y(height)
+        parts.append(f'<rect x="{x - bar_width / 2:.1f}" y="{y:.1f}" width="{bar_width:.1f}" '
+                     f'height="{plot.bottom - y:.1f}" fill="{color}"/>')
+        if label_format:
+            parts.append(svg_text(x, plot.y(height + label_offset) - 3, label_format.format(height), size=label_size))
+    return parts
+
+def wrap_label(label):
+    return "\n".join(str(label).split())
+
+def svg_stacked_bar_chart(data):
+    if data.empty:
+        return svg_message("No data available")
+    totals = data.sum(axis=1)
+    ticks = nice_ticks(totals.max() if len(totals) else 0)
+    plot = SvgPlot(ticks[-1], right=150)
+    parts = plot.axes("Total Spent", ticks, grid=True)
+
+    bottoms = [0.0] * len(data.index)
+    for method, color in zip(data.columns, color_palette):
+        for i, height in enumerate(data[method]):
+            x, slot_width = plot.slot(i, len(data.index))
+            top, base = plot.y(bottoms[i] + height), plot.y(bottoms[i])
+            parts.append(f'<rect x="{x - slot_width / 4:.1f}" y="{top:.1f}" width="{slot_width / 2:.1f}" '
+                         f'height="{base - top:.1f}" fill="{color}"/>')
+            bottoms[i] += height
+    parts += plot.xlabels([wrap_label(label) for label in data.index])
+
+    # Legend outside the plot area, to the right
+    legend_x, legend_y = plot.right + 15, plot.top + 20
+    parts.append(svg_text(legend_x, legend_y, "Payment Method", size=11, anchor="start"))
+    for i, (method, color) in enumerate(zip(data.columns, color_palette)):
+        y = legend_y + 18 * (i + 1)
+        parts.append(f'<rect x="{legend_x}" y="{y - 10}" width="12" height="12" fill="{color}"/>')
+        parts.append(svg_text(legend_x + 18, y, method, size=11, anchor="start"))
+    return svg_document(parts)
+
+def svg_donut_chart(counts, selected_category):
+    title = "Category Distribution" if selected_category == "All" else f"Category Distribution: {selected_category}"
+    if counts.empty:
+        return svg_message("No data available", "Category Distribution")
+
+    cx, cy, outer = svg_width / 2, svg_height / 2 + 15, 140
+    inner = outer * 0.2  # Same ring width as wedgeprops={'width': 0.8}
+    shares = counts / counts.sum()
+    parts = []
+    angle = 90.0  # Start at the top and go counterclockwise, like the pie chart
+    for (label, share), color in zip(shares.items(), color_palette * len(shares)):
+        sweep = 360 * share
+        start, end = math.radians(angle), math.radians(angle + sweep)
+        large = 1 if sweep > 180 else 0
+        points = [
+            (cx + outer * math.cos(start), cy - outer * math.sin(start)),
+            (cx + outer * math.cos(end), cy - outer * math.sin(end)),
+            (cx + inner * math.cos(end), cy - inner * math.sin(end)),
+            (cx + inner * math.cos(start), cy - inner * math.sin(start)),
+        ]
+        if share >= 1:
+            # A single category: two half rings, since an arc cannot end where it starts
+            parts.append(f'<circle cx="{cx}" cy="{cy}" r="{(outer + inner) / 2}" fill="none" '
+                         f'stroke="{color}" stroke-width="{outer - inner}"/>')
+        else:
+            parts.append(
+                f'<path d="M{points[0][0]:.1f},{points[0][1]:.1f} '
+                f'A{outer},{outer} 0 {large} 0 {points[1][0]:.1f},{points[1][1]:.1f} '
+                f'L{points[2][0]:.1f},{points[2][1]:.1f} '
+                f'A{inner},{inner} 0 {large} 1 {points[3][0]:.1f},{points[3][1]:.1f} Z" fill="{color}"/>'
+            )
+
+        middle = math.radians(angle + sweep / 2)
+        cos, sin = math.cos(middle), math.sin(middle)
+        percent_radius = (outer + inner) / 2
+        parts.append(svg_text(cx + percent_radius * cos, cy - percent_radius * sin + 4, f"{share * 100:.1f}%", size=12))
+        parts.append(svg_text(
+            cx + (outer + 12) * cos, cy - (outer + 12) * sin + 4, wrap_label(label),
+            size=12, anchor="start" if cos >= 0 else "end",
+        ))
+        angle += sweep
+    return svg_document(parts, title)
+
+def svg_bar_chart_avg_price(category_avg_price_sorted):
+    if category_avg_price_sorted.empty:
+        return svg_message("No data available", 'Average Price Per Unit by Category')
+    values = category_avg_price_sorted['Average Price Per Unit']
+    ticks = nice_ticks(values.max() * 1.1)
+    plot = SvgPlot(ticks[-1], top=55, bottom=115)
+    max_value_category = category_avg_price_sorted.iloc[0]['Category']
+    parts = plot.axes("Average Price Per Unit", ticks)
+    parts += svg_bars(
+        plot, values,
+        ['orange' if category == max_value_category else 'teal' for category in category_avg_price_sorted['Category']],
+        width=0.5, label_format="{:.2f}", label_size=10,
+    )
+    parts += plot.xlabels([wrap_label(label) for label in category_avg_price_sorted['Category']])
+    return svg_document(parts, 'Average Price Per Unit by Category')
+
+def svg_bar_chart_month(month_total_spent, shared_max):
+    if month_total_spent.empty:
+        return svg_message("No data available", 'Total Spent by Month')
+    plot = SvgPlot(shared_max * 1.15)  # Extra padding for labels
+    max_value_month = month_total_spent.loc[month_total_spent['Total Spent'].idxmax(), 'Month Name']
+    parts = plot.axes('Total Spent', nice_ticks(shared_max))
+    parts += svg_bars(
+        plot, month_total_spent['Total Spent'],
+        ['orange' if month == max_value_month else '#48A6A7' for month in month_total_spent['Month Name']],
+        label_format="{:,.0f}", label_offset=shared_max * 0.02,
+    )
+    parts += plot.xlabels(month_total_spent['Month Name'])
+    return svg_document(parts, 'Total Spent by Month')
+
+def svg_bar_chart_day(day_total_spent, shared_max):
+    if day_total_spent.empty:
+        return svg_message("No data available", 'Total Spent by Day of the Week')
+    plot = SvgPlot(shared_max * 1.1)  # Add 10% padding
+    max_value_day = day_total_spent.loc[day_total_spent['Total Spent'].idxmax(), 'Day Name']
+    parts = plot.axes('Total Spent', nice_ticks(shared_max))
+    parts += svg_bars(
+        plot, day_total_spent['Total Spent'],
+        ['orange' if day == max_value_day else '#9ACBD0' for day in day_total_spent['Day Name']],
+        width=0.5, label_format="{:,.0f}",
+    )
+    parts += plot.xlabels(day_total_spent['Day Name'])
+    return svg_document(parts, 'Total Spent by Day of the Week')
+
+# The SVG counterpart of each matplotlib chart, taking the same arguments
+svg_charts = {
+    draw_stacked_bar_chart: svg_stacked_bar_chart,
+    draw_donut_chart: svg_donut_chart,
+    draw_bar_chart_avg_price: svg_bar_chart_avg_price,
+    draw_bar_chart_month: svg_bar_chart_month,
+    draw_bar_chart_day: svg_bar_chart_day,
+}
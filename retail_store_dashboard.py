@@ -1,53 +1,1896 @@
-from shiny import App, render, ui
+from shiny import App, reactive, render, req, ui
+from shiny.reactive import get_current_context
+from shiny.render.renderer import Renderer
+from shiny.session import get_current_session
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, NamedTuple
 import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
+import asyncio
+import contextvars
+import datetime
+import io
+import json
+import logging
+import multiprocessing
 import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+
+try:
+    import fcntl  # Not available on Windows, where the dataset store is not locked
+except ImportError:
+    fcntl = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+from retail_store_charts import (
+    draw_bar_chart_avg_price,
+    draw_bar_chart_day,
+    draw_bar_chart_month,
+    draw_donut_chart,
+    draw_stacked_bar_chart,
+    init_plot_worker,
+    release_templates,
+    render_plot,
+    svg_charts,
+)
+
+logger = logging.getLogger(__name__)
 
-# Load the dataset with error handling
-file_path = r"D:\My\Other\Python\Shiny for python\corporate_stress_dataset\retail_store_sales.csv"
+# Load the dataset with error handling (RETAIL_SALES_CSV points at another feed)
+file_path = os.environ.get(
+    "RETAIL_SALES_CSV",
+    r"D:\My\Other\Python\Shiny for python\corporate_stress_dataset\retail_store_sales.csv",
+)
 if not os.path.exists(file_path):
     raise FileNotFoundError(f"Dataset not found at {file_path}")
 
-df = pd.read_csv(file_path)
-
-# Ensure required columns exist
-required_columns = ["Transaction Date", "Category", "Total Spent", "Payment Method"]
-for col in required_columns:
-    if col not in df.columns:
-        raise ValueError(f"Missing required column: {col}")
-
-# Data preprocessing
-df = df.dropna(subset=["Transaction Date"])
-df[['Year', 'Month', 'Day']] = df['Transaction Date'].str.split('-', expand=True)
-
 # Shorten long category labels
 category_replacements = {
     'Electric household essentials': 'Electric Essentials',
     'Computers and electric accessories': 'Computers & Accessories'
 }
-df['Category'] = df['Category'].replace(category_replacements)
 
-data = df.copy()
+# Column types applied while parsing: repeated strings are dictionary-encoded as
+# categoricals (grouping on their integer codes avoids hashing strings), Discount
+# Applied is a nullable boolean and the measures are float32. Aggregates are still
+# computed in float64.
+transaction_schema = {
+    'Transaction ID': 'str',
+    'Customer ID': 'category',
+    'Category': 'category',
+    'Item': 'category',
+    'Price Per Unit': 'float32',
+    'Quantity': 'float32',
+    'Total Spent': 'float32',
+    'Payment Method': 'category',
+    'Location': 'category',
+    'Discount Applied': 'boolean',
+}
+
+row_order = ['Category', 'Location', 'Transaction Date']
 
-data1 = data[data['Quantity'] > 0]
+def read_transactions_csv(source, **kwargs):
+    return pd.read_csv(source, dtype=transaction_schema, **kwargs)
+
+required_columns = ["Transaction Date", "Category", "Total Spent", "Payment Method"]
+
+def check_columns(df):
+    for col in required_columns:
+        if col not in df.columns:
+            raise ValueError(f"Missing required column: {col}")
+
+def prepare_transactions(df):
+    # Ensure required columns exist
+    check_columns(df)
+
+    # Data preprocessing: parse dates once, with an explicit format, and keep integer
+    # date parts for the outputs (Weekday: 0 = Monday)
+    df['Transaction Date'] = pd.to_datetime(df['Transaction Date'], format='%Y-%m-%d', errors='coerce')
+    df = df.dropna(subset=["Transaction Date"])
+    df['Year'] = df['Transaction Date'].dt.year.astype('int16')
+    df['Month'] = df['Transaction Date'].dt.month.astype('int8')
+    df['Weekday'] = df['Transaction Date'].dt.dayofweek.astype('int8')
+
+    # Rename on the dictionary rather than on every row, keeping categories sorted
+    category = df['Category'].astype('category').cat.rename_categories(
+        lambda label: category_replacements.get(label, label)
+    )
+    df['Category'] = category.cat.reorder_categories(sorted(category.cat.categories))
+
+    # Store rows grouped by category so every category is one contiguous block, and
+    # by date within each location of a category (see Date and location index)
+    return df.sort_values(row_order, kind='stable').reset_index(drop=True)
+
+def memory_report(frame):
+    # Bytes held by each column, string data included, largest first
+    usage = frame.memory_usage(index=False, deep=True)
+    return pd.DataFrame({'dtype': frame.dtypes.astype(str), 'bytes': usage}).sort_values('bytes', ascending=False)
+
+class PrefixReader(io.RawIOBase):
+    # The first size bytes of a file
+    def __init__(self, f, size):
+        self.f = f
+        self.left = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.f.readinto(memoryview(buffer)[:self.left])
+        self.left -= count
+        return count
+
+@contextmanager
+def open_transactions(path, size=None):
+    # The CSV up to size bytes (all of it for None): rows appended while it is parsed
+    # are left for ingestion
+    with open(path, 'rb') as f:
+        yield f if size is None else io.BufferedReader(PrefixReader(f, size), buffer_size=1 << 20)
+
+def load_transactions(path, size=None):
+    with open_transactions(path, size) as f:
+        return prepare_transactions(read_transactions_csv(f))
+
+#-------- Dataset store --------#
+
+# The preprocessed columns, and the aggregates derived from them (the cube and the
+# spend per customer), are kept as one .npy file per column, so a restart memory-maps
+# them instead of parsing the CSV and aggregating again. With several workers
+# (uvicorn --workers N) every worker maps the same files read-only, so the operating
+# system keeps one copy of the data for all of them. Only one worker builds a missing
+# or stale store while the others wait for it; running this script once before the
+# workers start builds it ahead of time. RETAIL_CACHE_DIR keeps the store somewhere
+# else than next to the CSV, e.g. in /dev/shm to hold it in shared memory. With an SQL
+# query engine the store holds the daily bins as a database instead of columns (see
+# Query backend). Bump cache_format whenever prepare_transactions or the aggregates
+# change what they produce.
+cache_format = 6
+cache_root = os.environ.get("RETAIL_CACHE_DIR")
+if cache_root:
+    cache_dir = os.path.join(cache_root, os.path.basename(file_path) + ".cache")
+else:
+    cache_dir = file_path + ".cache"
+
+def complete_size(path, size):
+    # Bytes up to and including the last newline within the first size bytes
+    with open(path, 'rb') as f:
+        end = size
+        while end > 0:
+            start = max(0, end - 64 * 1024)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+def source_fingerprint(path, whole_lines=False):
+    # size is the number of bytes loaded; with whole_lines it stops after the last
+    # complete line, so a row still being appended is left for ingestion
+    stat = os.stat(path)
+    return {
+        "format": cache_format,
+        "size": complete_size(path, stat.st_size) if whole_lines else stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "arrow": pa is not None,  # Arrow-backed strings are stored as Arrow buffers
+    }
+
+def write_columns(frame, directory):
+    os.makedirs(directory, exist_ok=True)
+    columns = []
+    for position, (name, column) in enumerate(frame.items()):
+        stem = os.path.join(directory, f"column_{position}")
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # Stored as they are held in memory: integer codes plus the categories
+            np.save(stem + ".npy", column.cat.codes.to_numpy())
+            np.save(stem + "_categories.npy", np.asarray(column.cat.categories, dtype=str))
+            columns.append({"name": name, "kind": "dictionary"})
+        elif isinstance(column.dtype, pd.BooleanDtype):
+            np.save(stem + ".npy", column.fillna(False).to_numpy(dtype=bool))
+            np.save(stem + "_mask.npy", column.isna().to_numpy())
+            columns.append({"name": name, "kind": "boolean"})
+        elif pd.api.types.is_numeric_dtype(column) or pd.api.types.is_datetime64_any_dtype(column):
+            np.save(stem + ".npy", column.to_numpy())
+            columns.append({"name": name, "kind": "array"})
+        elif pa is not None and isinstance(column.dtype, pd.StringDtype) and column.dtype.storage == "pyarrow":
+            # Arrow strings are stored as their offsets and UTF-8 bytes, which map
+            # back into an Arrow array without decoding or copying
+            strings = pa.array(column)
+            validity, offsets, data = strings.buffers()
+            offset_type = np.int64 if strings.type == pa.large_string() else np.int32
+            offsets = np.frombuffer(offsets, dtype=offset_type)[strings.offset:strings.offset + len(strings) + 1]
+            np.save(stem + ".npy", offsets)
+            np.save(stem + "_data.npy", np.frombuffer(data or b"", dtype=np.uint8))
+            np.save(stem + "_validity.npy", np.packbits(column.notna().to_numpy(), bitorder="little"))
+            columns.append({"name": name, "kind": "utf8", "large": bool(offset_type is np.int64)})
+        else:
+            # Other strings are dictionary-encoded on disk and decoded when read
+            codes, categories = pd.factorize(column, sort=True)
+            np.save(stem + ".npy", codes.astype(np.int32))
+            np.save(stem + "_categories.npy", np.asarray(categories, dtype=str))
+            columns.append({"name": name, "kind": "string"})
+    return columns
+
+def read_columns(directory, table):
+    columns = {}
+    for position, column in enumerate(table["columns"]):
+        stem = os.path.join(directory, f"column_{position}")
+        values = np.load(stem + ".npy", mmap_mode="r")
+        if column["kind"] == "dictionary":
+            categories = np.load(stem + "_categories.npy")
+            values = pd.Categorical.from_codes(values, categories=categories)
+        elif column["kind"] == "boolean":
+            values = pd.arrays.BooleanArray(values, np.load(stem + "_mask.npy", mmap_mode="r"))
+        elif column["kind"] == "utf8":
+            buffers = [np.load(stem + suffix, mmap_mode="r") for suffix in ("_validity.npy", ".npy", "_data.npy")]
+            strings = pa.Array.from_buffers(
+                pa.large_string() if column["large"] else pa.string(), table["rows"], list(map(pa.py_buffer, buffers)),
+            )
+            values = pd.array(strings, dtype='str')
+        elif column["kind"] == "string":
+            categories = np.load(stem + "_categories.npy")
+            values = pd.array(np.append(categories, None)[values], dtype='str')  # Code -1 is missing
+        columns[column["name"]] = values
+    return pd.DataFrame(columns, copy=False)
+
+@contextmanager
+def store_lock(exclusive):
+    # Shared while a store is read and exclusive while one is built, so only one
+    # process builds it and none reads it halfway through being replaced
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_dir)), exist_ok=True)
+        lock_file = open(cache_dir + ".lock", "a")
+    except OSError:
+        lock_file = None  # Read-only location: the store cannot be written either
+    try:
+        if lock_file is not None and fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        if lock_file is not None:
+            lock_file.close()  # Also releases the lock
+
+def write_dataset_store(tables, fingerprint):
+    # The store is written to a new directory that then takes the place of the old
+    # one. Processes still mapping the old files keep reading them until they reload.
+    staging, retired = f"{cache_dir}.{os.getpid()}.tmp", f"{cache_dir}.{os.getpid()}.old"
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        manifest = {"fingerprint": fingerprint, "tables": {}}
+        for name, frame in tables.items():
+            if name == "daily" and query_engine != "pandas":
+                continue  # Held in the database instead
+            columns = write_columns(frame, os.path.join(staging, name))
+            manifest["tables"][name] = {"rows": len(frame), "columns": columns}
+        if query_engine != "pandas":
+            write_query_database(tables["daily"], os.path.join(staging, query_database_file))
+            manifest["database"] = {"engine": query_engine, "file": query_database_file}
+        with open(os.path.join(staging, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        if os.path.exists(cache_dir):
+            os.replace(cache_dir, retired)
+        os.replace(staging, cache_dir)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.rmtree(retired, ignore_errors=True)
+
+def read_dataset_store(fingerprint, names):
+    try:
+        with open(os.path.join(cache_dir, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("fingerprint") != fingerprint or not set(names) <= set(manifest["tables"]):
+        return None
+    tables = {name: read_columns(os.path.join(cache_dir, name), manifest["tables"][name]) for name in names}
+    if query_engine != "pandas":
+        # Opened while the store is locked, so it holds the same data as the tables
+        if manifest.get("database", {}).get("engine") != query_engine:
+            return None
+        tables["database"] = QueryDatabase(connect_query_database(os.path.join(cache_dir, query_database_file)))
+    return tables
+
+#-------- Aggregate cube --------#
+
+# Every chart only needs totals along these dimensions, so the raw transactions are
+# reduced once at load into a small cube and each render slices that instead.
+cube_dimensions = ['Category', 'Payment Method', 'Year', 'Month', 'Weekday']
+
+def aggregate_measures(frame, dimensions):
+    # Measures are stored as float32 and summed as float64
+    quantity = frame['Quantity'].astype('float64')
+    cells = frame[dimensions].assign(**{
+        'Total Spent': frame['Total Spent'].astype('float64'),
+        'Quantity': quantity,
+        # Price Per Unit divided by Quantity, only defined for positive quantities
+        'Adjusted Price': frame['Price Per Unit'].astype('float64') / quantity.where(quantity > 0),
+    })
+
+    # Keep rows with missing keys so that every transaction lands in some cell
+    return cells.groupby(dimensions, dropna=False, observed=True).agg(**{
+        'Total Spent': ('Total Spent', 'sum'),
+        'Spent Count': ('Total Spent', 'count'),
+        'Quantity': ('Quantity', 'sum'),
+        'Quantity Count': ('Quantity', 'count'),
+        'Adjusted Price': ('Adjusted Price', 'sum'),
+        'Adjusted Price Count': ('Adjusted Price', 'count'),
+        'Transactions': ('Total Spent', 'size'),
+    })
+
+def build_sales_cube(frame):
+    return aggregate_measures(frame, cube_dimensions)
+
+# The same cells per calendar day and location. Day counts days since 1970-01-01;
+# Year, Month and Weekday follow from it and are kept for the charts.
+daily_dimensions = ['Category', 'Location', 'Payment Method', 'Day', 'Year', 'Month', 'Weekday']
+
+def build_daily_bins(frame):
+    day = frame['Transaction Date'].to_numpy().astype('datetime64[D]').astype(np.int32)
+    return aggregate_measures(frame.assign(Day=day), daily_dimensions)
+
+def customer_spend(frame):
+    # Total spend per category and customer, the only per-row detail the outputs need
+    # besides the cube (rows without a Customer ID are not counted)
+    frame = frame[frame['Customer ID'].notna()]
+    spent = frame['Total Spent'].astype('float64')
+    return spent.groupby([frame['Category'], frame['Customer ID']], dropna=False, observed=True).sum()
+
+# Cubes and customer totals of separate batches of rows add up cell by cell
+def merge_cubes(cubes):
+    return pd.concat(cubes).groupby(level=cube_dimensions, dropna=False, observed=True).sum()
+
+def merge_daily_bins(parts):
+    return pd.concat(parts).groupby(level=daily_dimensions, dropna=False, observed=True).sum()
+
+def merge_customer_spend(parts):
+    return pd.concat(parts).groupby(level=['Category', 'Customer ID'], dropna=False, observed=True).sum()
+
+#-------- Chunked loading --------#
+
+# With RETAIL_CHUNK_ROWS > 0 the CSV is read that many rows at a time and only the
+# aggregates are kept, so peak memory is set by the chunk size and the number of cube
+# cells and customers instead of the file size. The raw rows are then not available
+# (the dataset store only holds the aggregates), which none of the outputs need.
+chunk_rows = int(os.environ.get("RETAIL_CHUNK_ROWS", "0"))
+merge_every = 32  # Partial aggregates held before they are merged into one
+
+def aggregate_in_chunks(path, rows, size=None):
+    cubes, bins, customers = [], [], []
+    with open_transactions(path, size) as f:
+        for chunk in read_transactions_csv(f, chunksize=rows):
+            chunk = prepare_transactions(chunk)
+            cubes.append(build_sales_cube(chunk))
+            bins.append(build_daily_bins(chunk))
+            customers.append(customer_spend(chunk))
+            if len(cubes) >= merge_every:
+                cubes, bins, customers = [merge_cubes(cubes)], [merge_daily_bins(bins)], [merge_customer_spend(customers)]
+    return merge_cubes(cubes), merge_daily_bins(bins), merge_customer_spend(customers)
+
+#-------- Top customers --------#
+
+# Spend per customer is kept overall and per category, together with the top_k
+# customers of each, so the table renders from top_k rows instead of grouping and
+# sorting every customer. Ingested rows only re-rank the previous leaders and the
+# customers they touch.
+top_k = int(os.environ.get("RETAIL_TOP_CUSTOMERS", "10"))
+
+@dataclass(frozen=True)
+class CustomerIndex:
+    totals: pd.Series  # Total spend by customer
+    by_category: dict  # Category -> total spend by customer
+    leaders: dict  # "All" and each category -> top_k customers, highest spend first
+
+    def top(self, selected_category=None, k=None):
+        selected_category = selected_category or "All"
+        k = top_k if k is None else k
+        if k <= top_k:
+            return self.leaders.get(selected_category, self.totals.iloc[:0]).head(k)
+
+        # More customers than are kept ranked: select them from the full totals
+        spend = self.totals if selected_category == "All" else self.by_category.get(selected_category, self.totals.iloc[:0])
+        return spend.nlargest(k)
+
+def build_customer_index(spend):
+    totals = spend.groupby(level='Customer ID', observed=True).sum()
+    by_category = {
+        category: group.droplevel('Category')
+        for category, group in spend.groupby(level='Category', observed=True)
+    }
+    leaders = {"All": totals.nlargest(top_k)}
+    leaders.update((category, group.nlargest(top_k)) for category, group in by_category.items())
+    return CustomerIndex(totals, by_category, leaders)
+
+def update_leaders(leaders, spend, delta):
+    if (delta < 0).any():
+        # A customer's spend went down (a refund), so anyone may now rank above them
+        return spend.nlargest(top_k)
+    # Nobody else's spend changed, so only the previous leaders and the customers
+    # with new rows can be in the top
+    return spend.loc[leaders.index.union(delta.index)].nlargest(top_k)
+
+def update_customer_index(index, spend):
+    delta = spend.groupby(level='Customer ID', observed=True).sum()
+    totals = index.totals.add(delta, fill_value=0)
+    by_category, leaders = dict(index.by_category), dict(index.leaders)
+    leaders["All"] = update_leaders(index.leaders["All"], totals, delta)
+
+    # Categories without new rows keep their spend and leaders as they are
+    for category, group in spend.groupby(level='Category', observed=True):
+        group = group.droplevel('Category')
+        if category in by_category:
+            by_category[category] = by_category[category].add(group, fill_value=0)
+            leaders[category] = update_leaders(leaders[category], by_category[category], group)
+        else:
+            by_category[category] = group
+            leaders[category] = group.nlargest(top_k)
+    return CustomerIndex(totals, by_category, leaders)
+
+#-------- Category partitions --------#
+
+def build_partitions(categories):
+    # categories must be grouped (rows are sorted by category at load), so each
+    # category maps to the slice of positions holding its contiguous block
+    categories = pd.Series(categories).astype('category')
+    codes = categories.cat.codes.to_numpy()
+    if len(codes) == 0:
+        return {}
+    starts = np.concatenate(([0], np.flatnonzero(codes[1:] != codes[:-1]) + 1))
+    stops = np.append(starts[1:], len(codes))
+    return {
+        categories.cat.categories[codes[start]]: slice(start, stop)
+        for start, stop in zip(starts, stops)
+        if codes[start] >= 0  # Rows without a category only show up under "All"
+    }
+
+def build_location_partitions(frame):
+    # Same for the (category, location) blocks within the categories
+    codes = np.column_stack([frame[column].astype('category').cat.codes.to_numpy() for column in ('Category', 'Location')])
+    if len(codes) == 0:
+        return {}
+    starts = np.concatenate(([0], np.flatnonzero((codes[1:] != codes[:-1]).any(axis=1)) + 1))
+    stops = np.append(starts[1:], len(codes))
+    return {
+        (frame['Category'].iat[start], frame['Location'].iat[start]): slice(start, stop)
+        for start, stop in zip(starts, stops)
+    }
+
+# Rows are held in segments: the frame loaded at startup plus the batches ingested
+# since (see TransactionFeed), each sorted by category with its own partition index.
+class Segment(NamedTuple):
+    frame: pd.DataFrame
+    partitions: dict
+    locations: dict  # (Category, Location) -> slice of rows, sorted by date
+
+def make_segment(frame):
+    return Segment(frame, build_partitions(frame['Category']), build_location_partitions(frame))
+
+# The rows behind one value of Category_filter, and the filters their aggregates are
+# queried with (see Query backend). Slicing by partition does not copy, and the views
+# are built once per snapshot, so filtering a render is a dictionary lookup. version
+# is the snapshot version in which the view last changed.
+class FilteredView(NamedTuple):
+    selected_category: str
+    version: int
+    segments: tuple  # Row slices, one per segment holding rows of the category
+    scope: tuple = ()  # Date range and location, for views narrowed down by them
+
+    @property
+    def key(self):
+        return (self.selected_category, self.version) + self.scope
+
+    def query(self, measures, group_by):
+        category = None if self.selected_category == "All" else self.selected_category
+        return AggregateQuery(tuple(measures), tuple(group_by), category, *self.scope)
+
+def build_views(segments, categories, version, previous=None, affected=()):
+    views = {"All": FilteredView("All", version, tuple(segment.frame for segment in segments))}
+    for category in categories:
+        if previous is not None and category not in affected and category in previous.views:
+            # No new rows for this category: keep the same view object, which tells
+            # sessions showing it that nothing changed
+            views[category] = previous.views[category]
+            continue
+        rows = tuple(
+            segment.frame.iloc[segment.partitions[category]]
+            for segment in segments if category in segment.partitions
+        )
+        views[category] = FilteredView(category, version, rows)
+    return views
+
+#-------- Date and location index --------#
+
+# Date range and location filters are answered from the daily bins instead of the rows.
+# Bins are sorted by day within each (Category, Location, Payment Method) partition and
+# carry running totals of the measures, so the total of any range is two binary
+# searches and a subtraction per partition, and the charts of a range aggregate its
+# bins. Neither depends on the number of rows. Rows are sorted the same way, so the
+# rows of a range are slices as well. With an SQL query engine no index is built: the
+# query database answers instead (see Query backend).
+measure_columns = [
+    'Total Spent', 'Spent Count', 'Quantity', 'Quantity Count',
+    'Adjusted Price', 'Adjusted Price Count', 'Transactions',
+]
+
+@dataclass(frozen=True)
+class DailyIndex:
+    bins: pd.DataFrame
+    days: np.ndarray  # Day of each bin
+    partitions: dict  # (Category, Location, Payment Method) -> slice of bins
+    running: np.ndarray  # Running totals of the measures, one row per bin after a row of 0
+    first_day: int
+    last_day: int
+
+    def bounds(self):
+        locations = sorted({location for _, location, _ in self.partitions if isinstance(location, str)})
+        return DateBounds(self.first_day, self.last_day, tuple(locations), len(self.days))
+
+    def spans(self, period, category=None, location=None):
+        # Positions of the bins within the period, one (start, stop) per partition
+        start, end = period or (self.first_day, self.last_day)
+        for (bin_category, bin_location, _), cells in self.partitions.items():
+            if (category is not None and bin_category != category) or (location is not None and bin_location != location):
+                continue
+            days = self.days[cells]
+            yield (cells.start + np.searchsorted(days, start, 'left'), cells.start + np.searchsorted(days, end, 'right'))
+
+    def totals(self, period, category=None, location=None):
+        totals = np.zeros(self.running.shape[1])
+        for start, stop in self.spans(period, category, location):
+            totals += self.running[stop] - self.running[start]
+        return pd.Series(totals, index=measure_columns)
+
+    def cube(self, period, category=None, location=None):
+        positions = [np.arange(start, stop) for start, stop in self.spans(period, category, location)]
+        cells = self.bins.iloc[np.concatenate(positions) if positions else []]
+        return cells.groupby(level=cube_dimensions, dropna=False, observed=True).sum()
+
+class DateBounds(NamedTuple):
+    first_day: int  # First and last day with transactions
+    last_day: int
+    locations: tuple  # Every location, sorted
+    bins: int  # Number of daily bins
+
+    def period(self, date_range):
+        # Days from the first to the last date of a date range, None when it covers
+        # every day of the data
+        if date_range is None or self.bins == 0:
+            return None
+        start, end = (
+            bound if date is None else int(np.datetime64(date, 'D').astype(np.int64))
+            for date, bound in zip(date_range, (self.first_day, self.last_day))
+        )
+        if start <= self.first_day and end >= self.last_day:
+            return None
+        return (start, end)
+
+def build_daily_index(bins):
+    codes = np.column_stack(bins.index.codes[:3])
+    if len(codes) == 0:
+        starts = stops = np.array([], dtype=int)
+    else:
+        starts = np.concatenate(([0], np.flatnonzero((codes[1:] != codes[:-1]).any(axis=1)) + 1))
+        stops = np.append(starts[1:], len(codes))
+    keys = bins.index.droplevel(['Day', 'Year', 'Month', 'Weekday'])
+    days = bins.index.get_level_values('Day').to_numpy()
+
+    measures = bins[measure_columns].to_numpy(dtype='float64')
+    running = np.vstack([np.zeros((1, len(measure_columns))), np.cumsum(measures, axis=0)])
+    return DailyIndex(
+        bins=bins,
+        days=days,
+        partitions={keys[start]: slice(start, stop) for start, stop in zip(starts, stops)},
+        running=running,
+        first_day=int(days.min()) if len(days) else 0,
+        last_day=int(days.max()) if len(days) else 0,
+    )
+
+def rows_in_period(segment, period, category=None, location=None):
+    # Slices of the segment's rows within the period (days, inclusive)
+    dates = segment.frame['Transaction Date'].to_numpy()
+    start, end = (np.datetime64(day, 'D').astype(dates.dtype) for day in (period[0], period[1] + 1))
+    for (row_category, row_location), rows in segment.locations.items():
+        if (category is not None and row_category != category) or (location is not None and row_location != location):
+            continue
+        first = rows.start + np.searchsorted(dates[rows], start, 'left')
+        last = rows.start + np.searchsorted(dates[rows], end, 'left')
+        if last > first:
+            yield segment.frame.iloc[first:last]
+
+#-------- Dataset snapshot --------#
+
+# The KPIs and average prices, over all the data or over a date range and location
+class SalesSummary(NamedTuple):
+    key: tuple  # Data version, plus the date range and location when narrowed down
+    total_quantity: int
+    total_spend: float
+    yearly_spend: pd.Series
+    yoy_change: float  # Percent change of the last year, NaN when not available
+    avg_price: pd.DataFrame  # Average price per unit by category, highest first
+
+def build_summary(key, total_quantity, total_spend, yearly_spend, price_sums, price_counts):
+    if len(yearly_spend) >= 2:
+        yoy_change = yearly_spend.pct_change().iloc[-1] * 100
+    else:
+        yoy_change = float('nan')
+
+    avg_price = (price_sums / price_counts).dropna()
+    avg_price = avg_price.sort_values(ascending=False).rename_axis('Category').reset_index(name='Average Price Per Unit')
+    return SalesSummary(key, int(total_quantity), float(total_spend), yearly_spend, yoy_change, avg_price)
+
+# Everything the outputs show is derived once per data version into a frozen snapshot,
+# so renders only read precomputed values and never write to state shared by sessions.
+@dataclass(frozen=True)
+class DatasetSnapshot:
+    version: int
+    segments: tuple
+    cube: pd.DataFrame
+    cube_cells: dict  # Category -> slice of its cube cells
+    summary: SalesSummary
+    customers: CustomerIndex
+    daily: DailyIndex  # None with an SQL query engine, which queries database instead
+    bounds: DateBounds
+    views: dict  # FilteredView for "All" and every category
+    database: object = None  # QueryDatabase of the daily bins
+
+    def view(self, selected_category, period=None, location=None):
+        selected_category = selected_category or "All"
+        if period is None and location is None:
+            return self.views[selected_category]
+
+        # Narrowed down by date or location: the row slices within them
+        category = None if selected_category == "All" else selected_category
+        rows_period = period or (self.bounds.first_day, self.bounds.last_day)
+        rows = tuple(
+            rows
+            for segment in self.segments
+            for rows in rows_in_period(segment, rows_period, category, location)
+        )
+        return FilteredView(selected_category, self.version, rows, (period, location))
+
+    def summarize(self, period=None, location=None):
+        # From the running totals of the daily bins (pandas query engine only)
+        if period is None and location is None:
+            return self.summary
+
+        start, end = period or (self.daily.first_day, self.daily.last_day)
+        totals = self.daily.totals(period, location=location)
+
+        # Spend of every year in the period with transactions
+        yearly_spend = {}
+        for year in range(np.datetime64(start, 'D').item().year, np.datetime64(end, 'D').item().year + 1):
+            first = max(start, int(np.datetime64(f"{year}-01-01", 'D').astype(np.int64)))
+            last = min(end, int(np.datetime64(f"{year}-12-31", 'D').astype(np.int64)))
+            year_totals = self.daily.totals((first, last), location=location)
+            if year_totals['Transactions'] > 0:
+                yearly_spend[year] = year_totals['Total Spent']
+        yearly_spend = pd.Series(yearly_spend, dtype='float64').rename_axis('Year')
+
+        by_category = pd.DataFrame({
+            category: self.daily.totals(period, category, location)
+            for category in self.views if category != "All"
+        }, index=measure_columns).T
+        return build_summary(
+            (self.version, period, location),
+            totals['Quantity'],
+            totals['Total Spent'],
+            yearly_spend,
+            by_category['Adjusted Price'],
+            by_category['Adjusted Price Count'],
+        )
+
+def build_snapshot(segments, cube, bins, customers, version, previous=None, affected=(), database=None):
+    # Either bins (pandas query engine) or database (SQL engines) holds the daily bins.
+    # Missing Total Spent and Quantity values count as 0.
+    by_category = cube.groupby(level='Category', observed=True)
+    summary = build_summary(
+        (version,),
+        cube['Quantity'].sum(),
+        cube['Total Spent'].sum(),
+        cube['Total Spent'].groupby(level='Year').sum(),
+        by_category['Adjusted Price'].sum(),
+        by_category['Adjusted Price Count'].sum(),
+    )
+    cube_cells = build_partitions(cube.index.get_level_values('Category'))
+    daily = build_daily_index(bins) if database is None else None
+    return DatasetSnapshot(
+        version=version,
+        segments=segments,
+        cube=cube,
+        cube_cells=cube_cells,
+        summary=summary,
+        customers=customers,
+        daily=daily,
+        bounds=daily.bounds() if daily is not None else query_backend.bounds(database, version),
+        views=build_views(segments, cube_cells, version, previous, affected),
+        database=database,
+    )
+
+def build_tables(path, size=None):
+    # The tables kept in the dataset store, from the first size bytes of the CSV; the
+    # aggregates are stored flat, with their index levels as the leading columns
+    if chunk_rows > 0:
+        cube, bins, spend = aggregate_in_chunks(path, chunk_rows, size)
+        return {"cube": cube.reset_index(), "daily": bins.reset_index(), "customers": spend.reset_index()}
+    frame = load_transactions(path, size)
+    return {
+        "transactions": frame,
+        "cube": build_sales_cube(frame).reset_index(),
+        "daily": build_daily_bins(frame).reset_index(),
+        "customers": customer_spend(frame).reset_index(),
+    }
+
+def load_tables(path, fingerprint):
+    # With an SQL query engine the daily bins are read from the store's database
+    names = ["cube", "daily", "customers"] if query_engine == "pandas" else ["cube", "customers"]
+    if chunk_rows <= 0:
+        names.insert(0, "transactions")
+    with store_lock(exclusive=False):
+        tables = read_dataset_store(fingerprint, names)
+    if tables is not None:
+        return tables
+
+    # Store missing or stale (the CSV changed): rebuild it from the CSV, unless another
+    # process did so while this one waited for the lock
+    with store_lock(exclusive=True):
+        tables = read_dataset_store(fingerprint, names)
+        if tables is not None:
+            return tables
+        tables = build_tables(path, fingerprint["size"])
+        try:
+            write_dataset_store(tables, fingerprint)
+        except OSError:
+            logger.warning("Could not write dataset store to %s", cache_dir, exc_info=True)
+            return tables
+        return read_dataset_store(fingerprint, names)
+
+def load_snapshot(path, fingerprint, version):
+    tables = load_tables(path, fingerprint)
+    cube = tables["cube"].set_index(cube_dimensions)
+    customers = build_customer_index(tables["customers"].set_index(['Category', 'Customer ID'])['Total Spent'])
+    if query_engine == "pandas":
+        bins, database = tables["daily"].set_index(daily_dimensions), None
+    else:
+        bins, database = None, tables.get("database")
+        if database is None:  # Kept in memory when the store could not be written
+            database = memory_query_database(tables["daily"])
+    if chunk_rows > 0:
+        return build_snapshot((), cube, bins, customers, version, database=database)
+    frame = tables["transactions"]
+    report = memory_report(frame)
+    logger.info("Transactions: %d rows, %.1f MB\n%s", len(frame), report['bytes'].sum() / 2**20, report.to_string())
+    return build_snapshot((make_segment(frame),), cube, bins, customers, version, database=database)
+
+#-------- Query backend --------#
+
+# The outputs ask for aggregates through declarative queries: which measures to sum,
+# grouped by which dimensions, for which category, days and location. The backend
+# picked with RETAIL_QUERY_ENGINE answers them:
+#
+#   pandas  (default) slices the cube, or the daily bins for a date range or location
+#   sqlite  runs them as SQL against a database of the daily bins kept in the dataset
+#           store, with the filters and group-by in the query
+#   duckdb  the same with DuckDB (needs the duckdb package)
+#
+# The SQL engines read the database file every worker shares, instead of holding the
+# bins in each worker's pandas frames: no daily index is built, and the first and last
+# day and the locations come from the database as well. The store's database stays
+# read-only: the bins of ingested rows go to a small delta table of each worker, in an
+# in-memory database attached to the store's, and queries add both up. Both backends
+# keep the latest RETAIL_QUERY_CACHE_ENTRIES results per worker.
+query_engine = os.environ.get("RETAIL_QUERY_ENGINE", "pandas")
+query_cache_entries = int(os.environ.get("RETAIL_QUERY_CACHE_ENTRIES", "256"))
+query_database_file = f"daily.{query_engine}"
+
+if query_engine not in ("pandas", "sqlite", "duckdb"):
+    raise ValueError(f"Unknown RETAIL_QUERY_ENGINE: {query_engine}")
+if query_engine == "duckdb" and duckdb is None:
+    raise ImportError("RETAIL_QUERY_ENGINE=duckdb needs the duckdb package")
+
+class AggregateQuery(NamedTuple):
+    measures: tuple  # Measures to sum (see measure_columns)
+    group_by: tuple  # Dimensions of the result (see cube_dimensions); missing keys are left out
+    category: str = None  # None for every category
+    period: tuple = None  # First and last day, None for every day
+    location: str = None  # None for every location
+
+def connect_query_database(path, read_only=True):
+    if query_engine == "duckdb":
+        return duckdb.connect(path, read_only=read_only and path != ":memory:")
+    if read_only and path != ":memory:":
+        path = "file:" + urllib.parse.quote(os.path.abspath(path)) + "?mode=ro"
+    # Shared by the threads of a worker; the backend serializes its use
+    return sqlite3.connect(path, uri=True, check_same_thread=False)
+
+def fill_query_database(connection, bins, table="daily"):
+    # bins is flat, with the daily dimensions as its leading columns. They are added to
+    # the rows already in the table: bins of the same day may repeat, as every query
+    # sums them.
+    if query_engine == "duckdb":
+        connection.register("bins", bins)
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table} AS SELECT * FROM bins WHERE false")
+        connection.execute(f"INSERT INTO {table} SELECT * FROM bins")
+        connection.unregister("bins")
+    else:
+        types = {
+            name: "INTEGER" if pd.api.types.is_integer_dtype(column) else "REAL" if pd.api.types.is_float_dtype(column) else "TEXT"
+            for name, column in bins.items()
+        }
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (" + ", ".join(f'"{name}" {kind}' for name, kind in types.items()) + ")")
+        values = bins.astype(object).where(bins.notna(), None)
+        connection.executemany(
+            f"INSERT INTO {table} VALUES (" + ", ".join("?" * len(types)) + ")", values.itertuples(index=False, name=None),
+        )
+    connection.commit()
+
+def create_query_database(connection, bins):
+    fill_query_database(connection, bins)
+    connection.execute('CREATE INDEX daily_filters ON daily ("Category", "Location", "Day")')
+    connection.commit()
+
+def write_query_database(bins, path):
+    connection = connect_query_database(path, read_only=False)
+    try:
+        create_query_database(connection, bins)
+    finally:
+        connection.close()
+
+class QueryDatabase:
+    # A connection to a database of the daily bins: the store's, opened read-only, or an
+    # in-memory one when the store could not be written. Bins of rows ingested later
+    # are kept in the delta table of an attached in-memory database, each with the data
+    # version that added it, so older snapshots still see their own data.
+    def __init__(self, connection):
+        self.connection = connection
+        self.has_delta = False
+
+    def source(self, version):
+        # What queries of a data version read from, and its parameters
+        if not self.has_delta:
+            return "daily", []
+        columns = ", ".join(f'"{column}"' for column in daily_dimensions + measure_columns)
+        return (
+            f'(SELECT {columns} FROM daily UNION ALL SELECT {columns} FROM delta.daily WHERE "Version" <= ?) AS bins',
+            [version],
+        )
+
+def memory_query_database(bins):
+    connection = connect_query_database(":memory:", read_only=False)
+    create_query_database(connection, bins)
+    return QueryDatabase(connection)
+
+def query_sql(query, source="daily", source_parameters=()):
+    conditions, parameters = [], list(source_parameters)
+    for column, value in (("Category", query.category), ("Location", query.location)):
+        if value is not None:
+            conditions.append(f'"{column}" = ?')
+            parameters.append(value)
+    if query.period is not None:
+        conditions.append('"Day" BETWEEN ? AND ?')
+        parameters += query.period
+    conditions += [f'"{column}" IS NOT NULL' for column in query.group_by]  # As pandas' groupby
+
+    groups = ", ".join(f'"{column}"' for column in query.group_by)
+    sums = ", ".join(f'SUM("{measure}") AS "{measure}"' for measure in query.measures)
+    sql = f"SELECT {groups + ', ' if groups else ''}{sums} FROM {source}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if groups:
+        sql += f" GROUP BY {groups} ORDER BY {groups}"
+    return sql, parameters
+
+class QueryBackend:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.results = OrderedDict()  # (data version, query) -> result, least recent first
+        self.lock = threading.Lock()
+
+    def aggregate(self, snapshot, query):
+        # Sums of the measures for each group, indexed by the group_by dimensions.
+        # Results are shared by every session asking the same, so callers must not
+        # modify them.
+        return self.cached((snapshot.version, query), lambda: self.run(snapshot, query))
+
+    def cached(self, key, compute):
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                return self.results[key]
+        result = compute()
+        with self.lock:
+            self.results[key] = result
+            while len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+        return result
+
+    def summarize(self, snapshot, period=None, location=None):
+        # The KPIs and average prices, from the spend per year and price per category
+        if period is None and location is None:
+            return snapshot.summary
+        by_year = self.aggregate(snapshot, AggregateQuery(('Total Spent', 'Quantity'), ('Year',), None, period, location))
+        by_category = self.aggregate(snapshot, AggregateQuery(
+            ('Adjusted Price', 'Adjusted Price Count'), ('Category',), None, period, location,
+        ))
+        return build_summary(
+            (snapshot.version, period, location),
+            by_year['Quantity'].sum(),
+            by_year['Total Spent'].sum(),
+            by_year['Total Spent'],
+            by_category['Adjusted Price'],
+            by_category['Adjusted Price Count'],
+        )
+
+class PandasBackend(QueryBackend):
+    def run(self, snapshot, query):
+        if query.period is None and query.location is None:
+            cells = snapshot.cube
+            if query.category is not None:
+                cells = cells.iloc[snapshot.cube_cells.get(query.category, slice(0, 0))]
+        else:
+            cells = self._cells(snapshot, query.category, query.period, query.location)
+        return cells[list(query.measures)].groupby(level=list(query.group_by), observed=True).sum()
+
+    def _cells(self, snapshot, category, period, location):
+        # The cube cells of the bins within a period and location, cached once for all
+        # the queries of a view
+        return self.cached(
+            (snapshot.version, 'cells', category, period, location),
+            lambda: snapshot.daily.cube(period, category, location),
+        )
+
+    def summarize(self, snapshot, period=None, location=None):
+        return snapshot.summarize(period, location)  # Running totals of the daily bins
+
+class SqlBackend(QueryBackend):
+    def add_bins(self, database, bins, version):
+        # Adds the flat bins of rows ingested in a data version to the delta table,
+        # replacing any left by an earlier attempt at the same version
+        with self.lock:
+            connection = database.connection
+            if not database.has_delta:
+                connection.execute("ATTACH ':memory:' AS delta")
+                fill_query_database(connection, bins.iloc[:0].assign(Version=version), "delta.daily")
+                database.has_delta = True
+            connection.execute('DELETE FROM delta.daily WHERE "Version" = ?', [version])
+            fill_query_database(connection, bins.assign(Version=version), "delta.daily")
+
+    def bounds(self, database, version):
+        with self.lock:
+            source, parameters = database.source(version)
+            bins, first_day, last_day = database.connection.execute(
+                f'SELECT COUNT(*), MIN("Day"), MAX("Day") FROM {source}', parameters,
+            ).fetchone()
+            locations = database.connection.execute(
+                f'SELECT DISTINCT "Location" FROM {source} WHERE "Location" IS NOT NULL ORDER BY 1', parameters,
+            ).fetchall()
+        return DateBounds(int(first_day or 0), int(last_day or 0), tuple(location for location, in locations), int(bins))
+
+    def run(self, snapshot, query):
+        with self.lock:
+            sql, parameters = query_sql(query, *snapshot.database.source(snapshot.version))
+            cursor = snapshot.database.connection.execute(sql, parameters)
+            rows = cursor.fetchall()
+            columns = [description[0] for description in cursor.description]
+        result = pd.DataFrame.from_records(rows, columns=columns)
+        return result.set_index(list(query.group_by)) if query.group_by else result
+
+query_backend = (PandasBackend if query_engine == "pandas" else SqlBackend)(query_cache_entries)
+
+#-------- Incremental ingestion --------#
+
+# With RETAIL_INGEST_INTERVAL > 0 the CSV is polled for appended rows, and
+# RETAIL_INGEST_DIR (optional) for new delta CSV files with the same columns. Only the
+# new bytes are parsed; they are folded into the cube and KPIs of a new snapshot. A
+# delta file is read once it has not changed for RETAIL_INGEST_SETTLE seconds, so one
+# still being copied is not read half-way; files whose name starts with "." are
+# ignored, so writing to ".name.csv" and renaming it makes a file available at once.
+# Rows that do not parse are logged and skipped, and the last good snapshot is served.
+ingest_interval = float(os.environ.get("RETAIL_INGEST_INTERVAL", "0"))
+ingest_dir = os.environ.get("RETAIL_INGEST_DIR")
+ingest_settle = float(os.environ.get("RETAIL_INGEST_SETTLE", "2"))
+max_segments = 16
+checksum_window = 64 * 1024  # Bytes at each end of the ingested CSV checked for a rewrite
+
+def parse_new_rows(header, data, source):
+    # Parses CSV rows given without their header. When the rows do not parse together,
+    # every line is parsed on its own and the bad ones are logged and left out.
+    try:
+        return read_transactions_csv(io.BytesIO(header + data))
+    except ValueError as error:
+        logger.warning("New rows in %s do not parse (%s); skipping the bad ones", source, error)
+    good = []
+    for number, line in enumerate(data.splitlines(keepends=True), 1):
+        try:
+            read_transactions_csv(io.BytesIO(header + line))
+        except ValueError as error:
+            logger.warning("Skipped new row %d in %s: %s", number, source, error)
+        else:
+            good.append(line)
+    return read_transactions_csv(io.BytesIO(header + b''.join(good))) if good else None
+
+class TransactionFeed:
+    def __init__(self, path, offset, drop_dir=None):
+        self.path = path
+        self.drop_dir = drop_dir
+        self.seen_files = set()
+        self.lock = threading.Lock()
+        self.reloading = False  # A rewritten CSV is being loaded in the background
+        self.reset(offset)
+
+    def reset(self, offset):
+        # Called once the CSV up to offset is in the current snapshot
+        self.offset = offset
+        with open(self.path, 'rb') as f:
+            self.header = f.readline()
+            self.inode = os.fstat(f.fileno()).st_ino
+            self.checksum = self.prefix_checksum(f)
+
+    def prefix_checksum(self, f):
+        # Checksum of the first and last bytes before the offset: a CSV regenerated to
+        # the same or a larger size differs there, without reading the whole file every
+        # poll. Leaves f at the offset.
+        f.seek(0)
+        checksum = zlib.crc32(f.read(min(self.offset, checksum_window)))
+        start = max(checksum_window, self.offset - checksum_window)
+        f.seek(start)
+        checksum = zlib.crc32(f.read(max(0, self.offset - start)), checksum)
+        f.seek(self.offset)
+        return checksum
+
+    def settled_files(self):
+        if not self.drop_dir:
+            return ()
+        files = []
+        for entry in sorted(os.scandir(self.drop_dir), key=lambda entry: entry.name):
+            if entry.name.endswith('.csv') and not entry.name.startswith('.') and entry.is_file():
+                stat = entry.stat()
+                settled = time.time_ns() - stat.st_mtime_ns >= ingest_settle * 1e9
+                files.append((entry.name, stat.st_size, stat.st_mtime_ns, settled))
+        return tuple(files)
+
+    def signature(self):
+        # Cheap to compute and changes whenever there may be new rows, including when
+        # a delta file has settled
+        stat = os.stat(self.path)
+        return (stat.st_size, stat.st_mtime_ns, stat.st_ino, self.settled_files())
+
+    def read_new_rows(self):
+        # Returns the unparsed new rows as raw frames, or None when the CSV was
+        # rewritten and has to be loaded from scratch
+        frames = []
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            size = stat.st_size
+            if stat.st_ino != self.inode or size < self.offset or self.prefix_checksum(f) != self.checksum:
+                return None
+            if size > self.offset:
+                tail = f.read(size - self.offset)
+
+                # Only take whole lines; a row still being written waits for the next
+                # poll. Bad rows are skipped for good, so the offset moves past them.
+                complete = tail.rfind(b'\n') + 1
+                if complete:
+                    rows = parse_new_rows(self.header, tail[:complete], self.path)
+                    if rows is not None:
+                        frames.append(rows)
+                    self.offset += complete
+                    self.checksum = self.prefix_checksum(f)
+
+        for name, _, _, settled in self.settled_files():
+            if settled and name not in self.seen_files:
+                path = os.path.join(self.drop_dir, name)
+                self.seen_files.add(name)  # A bad file is not read again either
+                try:
+                    with open(path, 'rb') as f:
+                        header = f.readline()
+                        rows = parse_new_rows(header, f.read(), path)
+                    if rows is not None:
+                        check_columns(rows)
+                        frames.append(rows)
+                except (OSError, ValueError) as error:
+                    logger.warning("Skipped delta file %s: %s", path, error)
+        return frames
+
+def fold_transactions(snapshot, new_rows):
+    delta = prepare_transactions(pd.concat(new_rows, ignore_index=True))
+    if delta.empty:
+        return snapshot
+
+    # Cube cells are sums and counts, so adding the new rows' cube keeps it exact
+    cube = merge_cubes([snapshot.cube, build_sales_cube(delta)])
+    if snapshot.daily is not None:
+        bins, database = merge_daily_bins([snapshot.daily.bins, build_daily_bins(delta)]), None
+    else:
+        bins, database = None, snapshot.database
+        query_backend.add_bins(database, build_daily_bins(delta).reset_index(), snapshot.version + 1)
+    customers = update_customer_index(snapshot.customers, customer_spend(delta))
+
+    # Keep the loaded frame as is and merge small batches once there are too many.
+    # A snapshot loaded in chunks holds no rows, so none are added to it either.
+    segments = snapshot.segments + (make_segment(delta),) if snapshot.segments else ()
+    if len(segments) > max_segments:
+        batches = pd.concat([segment.frame for segment in segments[1:]], ignore_index=True)
+        segments = (segments[0], make_segment(batches.sort_values(row_order, kind='stable').reset_index(drop=True)))
+
+    affected = set(delta['Category'].dropna().unique())
+    return build_snapshot(
+        segments, cube, bins, customers, snapshot.version + 1, previous=snapshot, affected=affected, database=database,
+    )
+
+def ingest_new_transactions():
+    # Sessions keep the last good snapshot when new data cannot be read
+    global dataset
+    with feed.lock:
+        if feed.reloading:
+            return dataset
+        try:
+            new_rows = feed.read_new_rows()
+            if new_rows is None:
+                # The CSV was replaced: reload it entirely, off the event loop (see
+                # Startup); sessions keep this snapshot until the new one is loaded
+                feed.reloading = True
+                threading.Thread(
+                    target=load_in_background, args=(dataset.version + 1,), name="dataset-loader", daemon=True,
+                ).start()
+            elif new_rows:
+                dataset = fold_transactions(dataset, new_rows)
+                logger.info("Ingested %d new rows (dataset version %d)", sum(map(len, new_rows)), dataset.version)
+        except Exception:
+            logger.exception("Could not ingest new transactions; serving dataset version %d", dataset.version)
+        return dataset
+
+# Loaded at import, unless RETAIL_BACKGROUND_LOAD=1 (see Startup). When ingesting, the
+# load stops after the last complete line and the feed starts there.
+background_load = os.environ.get("RETAIL_BACKGROUND_LOAD", "0") == "1"
+dataset_ready = threading.Event()
+startup_error = None  # Why the background load failed
+if background_load:
+    loaded_fingerprint, dataset = None, None
+else:
+    loaded_fingerprint = source_fingerprint(file_path, whole_lines=ingest_interval > 0)
+    dataset = load_snapshot(file_path, loaded_fingerprint, version=1)
+    dataset_ready.set()
+
+if ingest_interval > 0:
+    # A dataset loaded in the background sets the offset once it is loaded
+    feed = TransactionFeed(file_path, loaded_fingerprint["size"] if loaded_fingerprint else 0, ingest_dir)
+
+def dataset_signature():
+    if not dataset_ready.is_set():
+        return startup_error is not None  # Changes if the background load fails
+    return (feed.signature(), dataset.version) if ingest_interval > 0 else True
+
+if ingest_interval > 0 or background_load:
+    # A single poll shared by all sessions; its value is the latest snapshot, or None
+    # while the dataset is still loading in the background
+    @reactive.poll(dataset_signature, ingest_interval if ingest_interval > 0 else 0.5)
+    def current_dataset():
+        if not dataset_ready.is_set():
+            return None
+        return ingest_new_transactions() if ingest_interval > 0 else dataset
+else:
+    def current_dataset():
+        return dataset
+
+def loaded_dataset():
+    # Outputs stay empty until the dataset is loaded
+    return req(current_dataset())
 
 #-------- Global variant --------#
 
-def calculate_dynamic_shared_max(filtered_df):
-    # Calculate total spent by month
-    filtered_df['Month Name'] = filtered_df['Transaction Date'].dt.month_name()
-    month_total_spent = filtered_df.groupby('Month Name')['Total Spent'].sum()
+month_order = ['January', 'February', 'March', 'April', 'May', 'June',
+               'July', 'August', 'September', 'October', 'November', 'December']
+day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
 
-    # Calculate total spent by day
-    filtered_df['Day Name'] = filtered_df['Transaction Date'].dt.day_name()
-    day_total_spent = filtered_df.groupby('Day Name')['Total Spent'].sum()
+def calculate_dynamic_shared_max(snapshot, view):
+    # Calculate total spent by month and by day of the week
+    month_total_spent = query_backend.aggregate(snapshot, view.query(['Total Spent'], ['Month']))['Total Spent']
+    day_total_spent = query_backend.aggregate(snapshot, view.query(['Total Spent'], ['Weekday']))['Total Spent']
 
     # Calculate the shared maximum across both datasets
     shared_max = max(month_total_spent.max(), day_total_spent.max())
     return shared_max
 
-# Define a consistent color palette
-color_palette = ['#4E79A7', '#F28E2C', '#E15759', '#76B7B2', '#59A14F', '#EDC949']
+#-------- Plot cache --------#
+
+# Rendered images only depend on the output, its inputs, its size and the data version,
+# and the same few combinations are requested by every session, so they are cached
+# process-wide. RETAIL_PLOT_CACHE_MB bounds the memory the cached images may use.
+class PlotRequest(NamedTuple):
+    key: tuple  # Everything besides output id and size the image depends on
+    draw: Callable  # Chart function of retail_store_charts, drawing args
+    args: tuple
+
+def payload_size(image):
+    # PNG data URI or SVG markup
+    return len(image["src"] if "src" in image else image["html"])
+
+class PlotCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        size = payload_size(image)
+        with self._lock:
+            if key in self._images:
+                self._bytes -= payload_size(self._images.pop(key))
+            if size > self.max_bytes:
+                return
+            self._images[key] = image
+            self._bytes += size
+
+            # Evict least recently used images until back under budget
+            while self._bytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= payload_size(evicted)
+
+plot_cache = PlotCache(int(os.environ.get("RETAIL_PLOT_CACHE_MB", "64")) * 1024 * 1024)
+
+#-------- Plot workers --------#
+
+# With RETAIL_PLOT_PROCESSES > 0, cache misses are drawn and encoded in a pool of
+# worker processes so matplotlib never blocks the event loop. Workers are spawned
+# rather than forked and only import retail_store_charts, not this module.
+#
+# With RETAIL_BACKGROUND_RENDER=1, cached_plot does not wait for a cache miss to be
+# drawn: the output stays recalculating while the image is drawn in the pool (or, with
+# no pool, in one drawing thread, as the figure templates are not shared between
+# threads), and the session keeps handling input in the meantime. When new input
+# supersedes the request before it is drawn, the draw is cancelled. The pool and the
+# drawing thread are stopped, and the figure templates released, when the app shuts down.
+plot_processes = int(os.environ.get("RETAIL_PLOT_PROCESSES", "0"))
+background_render = os.environ.get("RETAIL_BACKGROUND_RENDER", "0") == "1"
+plot_pool = None
+draw_thread = None
+pending_renders = {}
+
+def get_plot_pool():
+    global plot_pool
+    if plot_pool is None:
+        plot_pool = ProcessPoolExecutor(
+            max_workers=plot_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_plot_worker,
+        )
+    return plot_pool
+
+def get_draw_thread():
+    global draw_thread
+    if draw_thread is None:
+        draw_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plot-draw")
+    return draw_thread
+
+def shutdown_plot_workers():
+    global plot_pool, draw_thread
+    if plot_pool is not None:
+        plot_pool.shutdown(cancel_futures=True)
+        plot_pool = None
+    if draw_thread is not None:
+        draw_thread.shutdown(cancel_futures=True)
+        draw_thread = None
+    release_templates()
+
+class PendingRender:
+    def __init__(self, future):
+        self.future = future
+        self.waiters = 0  # Renders awaiting the future
+
+def forget_render(key, pending):
+    # Only while it is still the render for key; a newer one may have replaced it
+    if pending_renders.get(key) is pending:
+        del pending_renders[key]
+
+async def render_in_pool(key, value, width, height, pixelratio):
+    global plot_pool
+
+    # Sessions missing the same image at the same time wait for a single render. A
+    # cancelled one may not have left pending_renders yet and counts as missing.
+    pending = pending_renders.get(key)
+    if pending is None or pending.future.cancelled():
+        executor = get_plot_pool() if plot_processes > 0 else get_draw_thread()
+        pending = PendingRender(asyncio.get_running_loop().run_in_executor(
+            executor, render_plot, value.draw, value.args, width, height, pixelratio
+        ))
+        pending_renders[key] = pending
+        pending.future.add_done_callback(lambda _, pending=pending: forget_render(key, pending))
+    pending.waiters += 1
+    try:
+        return await asyncio.shield(pending.future)
+    except asyncio.CancelledError:
+        # Nobody waits for the image any more: drop the draw unless it already started,
+        # and let the next request for it start a new one
+        if pending.waiters == 1:
+            pending.future.cancel()
+            forget_render(key, pending)
+        raise
+    except BrokenProcessPool:
+        # A worker died; the next render starts a fresh pool
+        broken, plot_pool = plot_pool, None
+        if broken is not None:
+            broken.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        pending.waiters -= 1
+
+#-------- Metrics --------#
+
+# With RETAIL_METRICS=1 every output records, per output id and filter value, how
+# often it is invalidated, the time spent in its function (the pandas work) and in
+# turning the value into the payload (for plots also split into matplotlib drawing
+# and PNG encoding), and the payload size. They are served as Prometheus text on
+# /metrics.
+metrics_enabled = os.environ.get("RETAIL_METRICS", "0") == "1"
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+size_buckets = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+class Counter:
+    def __init__(self, name, help, label_names):
+        self.name, self.help, self.label_names = name, help, label_names
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in self.values.items():
+                lines.append(f"{self.name}{format_labels(self.label_names, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, label_names, buckets):
+        self.name, self.help, self.label_names, self.buckets = name, help, label_names, buckets
+        self.values = {}  # labels -> [count per bucket..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, series in self.values.items():
+                for bound, count in zip(self.buckets, series):
+                    bucket_labels = format_labels(self.label_names, labels, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                bucket_labels = format_labels(self.label_names, labels, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{bucket_labels} {series[-1]}")
+                lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {series[-1]}")
+        return lines
+
+output_invalidations = Counter(
+    "retail_output_invalidations_total", "Times an output was invalidated.", ("output", "filter"),
+)
+output_seconds = Histogram(
+    "retail_output_seconds",
+    "Seconds per render stage: compute (output function), render (value to payload), "
+    "draw (matplotlib) and encode (rasterize and PNG-encode), the last two on cache misses only.",
+    ("output", "filter", "stage"),
+    latency_buckets,
+)
+output_bytes = Histogram(
+    "retail_output_payload_bytes", "Size of the JSON payload sent for an output.", ("output", "filter"), size_buckets,
+)
+plot_cache_requests = Counter(
+    "retail_plot_cache_requests_total", "Plot cache lookups by result.", ("output", "result"),
+)
+
+def render_metrics():
+    lines = []
+    for metric in (output_invalidations, output_seconds, output_bytes, plot_cache_requests):
+        lines += metric.exposition()
+    lines += [
+        "# HELP retail_plot_cache_bytes Bytes of images held in the plot cache.",
+        "# TYPE retail_plot_cache_bytes gauge",
+        f"retail_plot_cache_bytes {plot_cache._bytes}",
+    ]
+    return "\n".join(lines) + "\n"
+
+async def metrics_endpoint(request):
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# With RETAIL_PROFILE_SLOW_MS set as well, the event loop thread is sampled while an
+# output renders, and slow_render_hook receives the stacks of renders slower than that
+# (by default they are logged).
+profile_slow_ms = float(os.environ.get("RETAIL_PROFILE_SLOW_MS", "0"))
+profile_interval = 0.005  # Seconds between samples
+profile_depth = 12  # Innermost frames kept per sample
+
+class StackSampler:
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.samples = {}  # Stack (outermost frame first) -> number of samples
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(profile_interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < profile_depth:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}")
+                frame = frame.f_back
+            stack = tuple(reversed(stack))
+            self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+def log_slow_render(labels, seconds, samples):
+    top = sorted(samples.items(), key=lambda item: item[1], reverse=True)[:5]
+    logger.warning(
+        "Slow render of %s (filter %s): %.0f ms, %d samples\n%s",
+        *labels, seconds * 1000, sum(samples.values()),
+        "\n".join(f"{count:>5}  {' > '.join(stack)}" for stack, count in top),
+    )
+
+slow_render_hook = log_slow_render
+
+# The labels and start time of the output being rendered, for the stages timed deeper
+# down (see cached_plot)
+class RenderTiming(NamedTuple):
+    labels: tuple
+    start: float
+
+current_render = contextvars.ContextVar("current_render", default=None)
+
+def instrument(renderer, filter_value):
+    # Wraps a renderer's render and transform when metrics are enabled; filter_value
+    # is read without taking a dependency on it
+    if not metrics_enabled:
+        return renderer
+    render, transform = renderer.render, renderer.transform
+
+    async def timed_transform(value):
+        timing = current_render.get()
+        start = time.perf_counter()
+        output_seconds.observe(timing.labels + ("compute",), start - timing.start)
+        rendered = await transform(value)
+        output_seconds.observe(timing.labels + ("render",), time.perf_counter() - start)
+        return rendered
+
+    async def timed_render():
+        with reactive.isolate():
+            labels = (renderer.output_id, filter_value() or "All")
+        get_current_context().on_invalidate(lambda: output_invalidations.inc(labels))
+
+        token = current_render.set(RenderTiming(labels, time.perf_counter()))
+        sampler = StackSampler(threading.get_ident()) if profile_slow_ms > 0 else None
+        try:
+            if sampler is None:
+                rendered = await render()
+            else:
+                with sampler:
+                    rendered = await render()
+        finally:
+            seconds = time.perf_counter() - current_render.get().start
+            current_render.reset(token)
+        if sampler is not None and seconds * 1000 >= profile_slow_ms:
+            slow_render_hook(labels, seconds, sampler.samples)
+        output_bytes.observe(labels, len(json.dumps(rendered)))
+        return rendered
+
+    renderer.render, renderer.transform = timed_render, timed_transform
+    return renderer
+
+#-------- Chart outputs --------#
+
+# RETAIL_CHART_MODE=svg sends the charts as small SVG documents built from the same
+# aggregated series (see retail_store_charts) instead of PNGs rendered by matplotlib.
+chart_mode = os.environ.get("RETAIL_CHART_MODE", "png")
+if chart_mode not in ("png", "svg"):
+    raise ValueError(f"RETAIL_CHART_MODE must be 'png' or 'svg', not {chart_mode!r}")
+
+def chart_output(id):
+    return ui.output_plot(id) if chart_mode == "png" else ui.output_ui(id)
+
+class cached_plot(Renderer[PlotRequest]):
+    # Use in place of render.plot, with the function returning a PlotRequest instead of
+    # a figure; on a cache hit the draw function is never called.
+    def __init__(self, fn=None):
+        self.drawn = reactive.value(0)  # Counts background draws that finished
+        self.pending = None  # (key, task) of the background draw of the latest request
+        super().__init__(fn)
+
+    def auto_output_ui(self):
+        return chart_output(self.output_id)
+
+    async def transform(self, value):
+        if chart_mode == "svg":
+            return self.render_svg(value)
+
+        session = get_current_session()
+        width = session.clientdata.output_width()
+        height = session.clientdata.output_height()
+        req(width, height)
+        pixelratio = session.clientdata.pixelratio()
+
+        key = (self.output_id, value.key, width, height, pixelratio)
+        image = plot_cache.get(key)
+        timing = current_render.get()
+        if timing is not None:
+            plot_cache_requests.inc((self.output_id, "miss" if image is None else "hit"))
+        if image is None:
+            if background_render:
+                image, stages = self.draw_in_background(key, value, width, height, pixelratio)
+            elif plot_processes > 0:
+                image, stages = await render_in_pool(key, value, width, height, pixelratio)
+            else:
+                image, stages = render_plot(value.draw, value.args, width, height, pixelratio)
+            plot_cache.put(key, image)
+            if timing is not None:
+                for stage, seconds in stages.items():
+                    output_seconds.observe(timing.labels + (stage,), seconds)
+        return dict(image)
+
+    def draw_in_background(self, key, value, width, height, pixelratio):
+        # Returns the finished draw of key. Otherwise starts it, cancelling the draw of
+        # the request it supersedes, and leaves the output recalculating until it is done.
+        self.drawn()  # The output reruns when the draw is done
+        if self.pending is not None and self.pending[0] == key:
+            task = self.pending[1]
+            if task.done():
+                self.pending = None
+                return task.result()
+        else:
+            if self.pending is not None:
+                self.pending[1].cancel()
+            task = asyncio.create_task(render_in_pool(key, value, width, height, pixelratio))
+            task.add_done_callback(self.on_drawn)
+            self.pending = (key, task)
+        req(False, cancel_output="progress")
+
+    def on_drawn(self, task):
+        if not task.cancelled():
+            asyncio.create_task(self.rerun())
+
+    async def rerun(self):
+        async with reactive.lock():
+            with reactive.isolate():
+                drawn = self.drawn()
+            self.drawn.set(drawn + 1)
+            await reactive.flush()
+
+    def render_svg(self, value):
+        # Independent of the output size (the browser scales it), so the size is not
+        # read and resizing does not invalidate the output
+        key = (self.output_id, value.key, "svg")
+        payload = plot_cache.get(key)
+        timing = current_render.get()
+        if timing is not None:
+            plot_cache_requests.inc((self.output_id, "miss" if payload is None else "hit"))
+        if payload is None:
+            start = time.perf_counter()
+            payload = {"html": svg_charts[value.draw](*value.args), "deps": []}
+            if timing is not None:
+                output_seconds.observe(timing.labels + ("draw",), time.perf_counter() - start)
+            plot_cache.put(key, payload)
+        return payload
+
+#-------- Chart data --------#
+
+# What each chart draws, queried for a filtered view of a snapshot (or taken from the
+# sales summary, for the chart that does not follow the category). Used by the chart
+# outputs and the warm-up.
+def stacked_bar_request(snapshot, view):
+    data = query_backend.aggregate(snapshot, view.query(['Total Spent'], ['Category', 'Payment Method']))
+    data = data['Total Spent'].unstack(fill_value=0)
+    data = data.sort_values(by=data.columns.tolist(), ascending=False)
+
+    return PlotRequest(view.key, draw_stacked_bar_chart, (data,))
+
+def donut_request(snapshot, view):
+    # Share of transactions per category, largest first
+    transactions = query_backend.aggregate(snapshot, view.query(['Transactions'], ['Category']))['Transactions']
+    transactions = transactions[transactions > 0].sort_values(ascending=False, kind='stable')
+    counts = transactions / transactions.sum() * 100
+
+    return PlotRequest(view.key, draw_donut_chart, (counts, view.selected_category))
+
+def avg_price_request(summary):
+    # Average adjusted price per unit by category, precomputed in descending order
+    return PlotRequest(summary.key, draw_bar_chart_avg_price, (summary.avg_price,))
+
+def month_request(snapshot, view):
+    # Month numbers come out of the query already in calendar order
+    month_total_spent = query_backend.aggregate(snapshot, view.query(['Total Spent'], ['Month'])).reset_index()
+    month_total_spent['Month Name'] = [month_order[month - 1] for month in month_total_spent['Month']]
+
+    # Calculate the shared maximum for the y-axis
+    shared_max = calculate_dynamic_shared_max(snapshot, view)
+
+    return PlotRequest(view.key, draw_bar_chart_month, (month_total_spent, shared_max))
+
+def day_request(snapshot, view):
+    # Weekday codes come out of the query already in Monday-first order
+    day_total_spent = query_backend.aggregate(snapshot, view.query(['Total Spent'], ['Weekday'])).reset_index()
+    day_total_spent['Day Name'] = [day_order[day] for day in day_total_spent['Weekday']]
+
+    # Calculate the shared maximum for the y-axis
+    shared_max = calculate_dynamic_shared_max(snapshot, view)
+
+    return PlotRequest(view.key, draw_bar_chart_day, (day_total_spent, shared_max))
+
+#-------- Filter debounce --------#
+
+# Clicking quickly through the categories (or dragging the date slider) changes the
+# filter inputs several times a second. The changes are coalesced: filters only take
+# the inputs' values once they stayed unchanged for RETAIL_FILTER_DEBOUNCE_MS, so the
+# charts of the values in between are never computed or drawn. A page's first values
+# apply right away.
+filter_debounce = float(os.environ.get("RETAIL_FILTER_DEBOUNCE_MS", "150")) / 1000
+
+#-------- Export --------#
+
+# Downloads of the rows behind the current filters. Rows are read straight from the
+# row slices of the filtered view in chunks of RETAIL_EXPORT_CHUNK_ROWS, and every
+# chunk is serialized and sent before the next one is read, so an export holds one
+# chunk at a time however many rows it covers. Serializing runs in a worker thread,
+# which keeps the event loop serving other sessions during large exports. CSV can be
+# gzipped as a whole; Parquet (needs pyarrow) compresses its column chunks instead.
+export_chunk_rows = int(os.environ.get("RETAIL_EXPORT_CHUNK_ROWS", "50000"))
+export_formats = {"csv": "CSV", **({"parquet": "Parquet"} if pq is not None else {})}
+
+# The columns of the source CSV, in its order
+export_columns = [
+    'Transaction ID', 'Customer ID', 'Category', 'Item', 'Price Per Unit', 'Quantity',
+    'Total Spent', 'Payment Method', 'Location', 'Transaction Date', 'Discount Applied',
+]
+
+def export_chunks(view):
+    for rows in view.segments:
+        for start in range(0, len(rows), export_chunk_rows):
+            yield rows.iloc[start:start + export_chunk_rows][export_columns]
+
+class CsvExport:
+    def __init__(self, compress):
+        self.compressor = zlib.compressobj(wbits=31) if compress else None  # 31: gzip header
+        self.header = True
+
+    def write(self, chunk):
+        data = chunk.to_csv(index=False, header=self.header, date_format='%Y-%m-%d').encode()
+        self.header = False
+        return self.compressor.compress(data) if self.compressor else data
+
+    def close(self):
+        # An export without rows still gets the header
+        data = self.write(pd.DataFrame(columns=export_columns)) if self.header else b""
+        return data + self.compressor.flush() if self.compressor else data
+
+class ChunkSink(io.RawIOBase):
+    # File object for the Parquet writer that holds what was written until drained
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+if pa is not None:
+    # Categories are written as plain strings: the dictionaries of the segments differ
+    parquet_schema = pa.schema([
+        ('Transaction ID', pa.string()),
+        ('Customer ID', pa.string()),
+        ('Category', pa.string()),
+        ('Item', pa.string()),
+        ('Price Per Unit', pa.float32()),
+        ('Quantity', pa.float32()),
+        ('Total Spent', pa.float32()),
+        ('Payment Method', pa.string()),
+        ('Location', pa.string()),
+        ('Transaction Date', pa.date32()),
+        ('Discount Applied', pa.bool_()),
+    ])
+
+class ParquetExport:
+    # One row group per chunk, sent as soon as it is written
+    def __init__(self, compress):
+        self.sink = ChunkSink()
+        self.writer = pq.ParquetWriter(self.sink, parquet_schema, compression='gzip' if compress else 'snappy')
+
+    def write(self, chunk):
+        self.writer.write_table(pa.Table.from_pandas(chunk, schema=parquet_schema, preserve_index=False))
+        return self.sink.drain()
+
+    def close(self):
+        self.writer.close()
+        return self.sink.drain()
+
+export_media_types = {
+    ("csv", False): "text/csv",
+    ("csv", True): "application/gzip",
+    ("parquet", False): "application/vnd.apache.parquet",
+    ("parquet", True): "application/vnd.apache.parquet",
+}
+
+def export_filename(selected_category, export_format, compress):
+    name = "retail_store_sales" if selected_category == "All" else f"retail_store_sales_{selected_category}"
+    name = "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+    return f"{name}.{export_format}" + (".gz" if compress and export_format == "csv" else "")
+
+async def stream_export(view, export_format, compress):
+    start = time.perf_counter()
+    total = sum(len(rows) for rows in view.segments)
+    export = ParquetExport(compress) if export_format == "parquet" else CsvExport(compress)
+    sent = exported = 0
+    with ui.Progress(min=0, max=max(total, 1)) as progress:
+        progress.set(0, message="Exporting rows", detail=f"0 of {total:,}")
+        for chunk in export_chunks(view):
+            data = await asyncio.to_thread(export.write, chunk)
+            exported += len(chunk)
+            progress.set(exported, detail=f"{exported:,} of {total:,}")
+            if data:  # An empty chunk would end the chunked response
+                sent += len(data)
+                yield data
+        data = await asyncio.to_thread(export.close)
+        sent += len(data)
+        yield data
+    logger.info("Exported %d rows of %s as %s%s: %.1f MB in %.2fs", exported, view.selected_category,
+                export_format, " (gzip)" if compress else "", sent / 2**20, time.perf_counter() - start)
+
+#-------- Startup --------#
+
+# With RETAIL_BACKGROUND_LOAD=1 importing the app does not wait for the dataset: it is
+# loaded in a background thread, so the server starts right away and sessions show a
+# loading message until the data is there. Before the app reports ready on /readyz,
+# the charts of the unfiltered view are rendered once, which builds the figure
+# templates and fills the plot cache for the sizes in RETAIL_WARMUP_SIZES
+# (WIDTHxHEIGHT or WIDTHxHEIGHT@PIXELRATIO, comma-separated). /healthz answers as
+# soon as the server is up.
+def parse_size(text):
+    size, _, pixelratio = text.strip().partition("@")
+    width, height = map(int, size.split("x"))
+    return width, height, float(pixelratio or 1)
+
+warmup_sizes = [parse_size(size) for size in os.environ.get("RETAIL_WARMUP_SIZES", "600x400").split(",") if size.strip()]
+
+def warm_up(snapshot):
+    view = snapshot.view("All")
+    requests = {
+        "stacked_bar_chart": stacked_bar_request(snapshot, view),
+        "donut_chart": donut_request(snapshot, view),
+        "bar_chart_avg_price": avg_price_request(snapshot.summary),
+        "bar_chart_month": month_request(snapshot, view),
+        "bar_chart_day": day_request(snapshot, view),
+    }
+    # Cached under the keys cached_plot looks up
+    for output_id, request in requests.items():
+        if chart_mode == "svg":
+            payload = {"html": svg_charts[request.draw](*request.args), "deps": []}
+            plot_cache.put((output_id, request.key, "svg"), payload)
+            continue
+        for width, height, pixelratio in warmup_sizes:
+            image, _ = render_plot(request.draw, request.args, width, height, pixelratio)
+            plot_cache.put((output_id, request.key, width, height, pixelratio), image)
+
+def load_in_background(version=1):
+    # Also reloads a rewritten CSV while ingesting, as a later version
+    global dataset, loaded_fingerprint, startup_error
+    start = time.perf_counter()
+    try:
+        fingerprint = source_fingerprint(file_path, whole_lines=ingest_interval > 0)
+        snapshot = load_snapshot(file_path, fingerprint, version)
+    except Exception as error:
+        logger.exception("Could not load the dataset from %s", file_path)
+        if dataset_ready.is_set():
+            feed.reloading = False  # Retried when the CSV changes again
+        else:
+            startup_error = error
+        return
+    try:
+        warm_up(snapshot)
+    except Exception:
+        logger.warning("Warm-up failed; charts render on first request", exc_info=True)
+
+    if ingest_interval > 0:
+        with feed.lock:
+            loaded_fingerprint, dataset = fingerprint, snapshot
+            feed.reset(fingerprint["size"])
+            feed.reloading = False
+    else:
+        loaded_fingerprint, dataset = fingerprint, snapshot
+    dataset_ready.set()
+    logger.info("Dataset loaded and warmed up in %.1fs", time.perf_counter() - start)
+
+class FilterChoices(NamedTuple):
+    categories: dict
+    locations: dict
+    dates: tuple  # First and last day with transactions
+
+def filter_choices(snapshot):
+    # The date slider needs a range of at least one day
+    if snapshot is None:
+        today = datetime.date.today()
+        return FilterChoices({"All": "All"}, {"All": "All"}, (today - datetime.timedelta(days=1), today))
+    categories = [category for category in snapshot.views if category != "All"]
+    bounds = snapshot.bounds
+    first_day, last_day = bounds.first_day, max(bounds.last_day, bounds.first_day + 1)
+    return FilterChoices(
+        {"All": "All", **{category: category for category in categories}},
+        {"All": "All", **{location: location for location in bounds.locations}},
+        (np.datetime64(first_day, 'D').item(), np.datetime64(last_day, 'D').item()),
+    )
+
+# Before the dataset is loaded only "All" is known; sessions get the choices later
+ui_choices = filter_choices(dataset)
+
+async def liveness_endpoint(request):
+    return PlainTextResponse("ok")
+
+async def readiness_endpoint(request):
+    if dataset_ready.is_set():
+        return PlainTextResponse("ready")
+    if startup_error is not None:
+        return PlainTextResponse(f"failed: {startup_error}", status_code=503)
+    return PlainTextResponse("loading", status_code=503)
 
 app_ui = ui.page_fluid(
     ui.tags.style(
@@ -65,6 +1908,12 @@ app_ui = ui.page_fluid(
             font-weight: bold;
             padding: 10px;
         }
+        .loading-status {
+            text-align: center;
+            color: white;
+            font-size: 20px;
+            padding-bottom: 10px;
+        }
         .nav-panel-text {
             font-size: 18px;
             font-weight: bold;
@@ -121,8 +1970,24 @@ app_ui = ui.page_fluid(
     ),
     ui.tags.div(
         ui.tags.h1("Retail Store Sales Dashboard", class_="nav-title"),
+        ui.output_ui("loading_status") if background_load else None,
         class_="nav-box"
     ),
+    ui.card(
+        ui.layout_columns(
+            ui.input_slider(
+                "Date_range",
+                "Transaction Date",
+                min=ui_choices.dates[0],
+                max=ui_choices.dates[1],
+                value=ui_choices.dates,
+                time_format="%Y-%m-%d",
+                width="100%",
+            ),
+            ui.input_select("Location_filter", "Location", ui_choices.locations),
+            col_widths=(9, 3),
+        ),
+    ),
     ui.page_navbar(
         ui.nav_panel(
             ui.tags.span("Overview", class_="nav-panel-text"),
@@ -158,7 +2023,7 @@ app_ui = ui.page_fluid(
                                 class_="custom-card-header"
                             )
                         ),
-                        ui.output_plot("stacked_bar_chart"),
+                        chart_output("stacked_bar_chart"),
                         class_="equal-height-card"
                     ),
                     ui.card(
@@ -186,16 +2051,22 @@ app_ui = ui.page_fluid(
                             ui.input_radio_buttons(
                                 "Category_filter",
                                 "Select Category",
-                                {"All": "All", **{category: category for category in df['Category'].unique()}},
+                                ui_choices.categories,
                             ),
+                            # Rows are only kept in memory when not loaded in chunks
+                            ui.tags.div(
+                                ui.input_radio_buttons("Export_format", "Export format", export_formats, inline=True),
+                                ui.input_checkbox("Export_gzip", "Gzip compression"),
+                                ui.download_button("export_rows", "Export rows"),
+                            ) if chunk_rows == 0 else None,
                         ),
-                        ui.card(ui.output_plot("donut_chart")),
+                        ui.card(chart_output("donut_chart")),
                         col_widths=(4, 8)
                     ),
                 ),
-                ui.card(ui.output_plot("bar_chart_avg_price")),
-                ui.card(ui.output_plot("bar_chart_month")),
-                ui.card(ui.output_plot("bar_chart_day")),
+                ui.card(chart_output("bar_chart_avg_price")),
+                ui.card(chart_output("bar_chart_month")),
+                ui.card(chart_output("bar_chart_day")),
                 width=1/2
             ),
         ),
@@ -206,121 +2077,153 @@ app_ui = ui.page_fluid(
 #---------------------- PART1 ----------------------#
 # Define the server logic
 def server(input, output, session):
-    @output
-    @render.plot
-    def stacked_bar_chart():
-        selected_category = input.Category_filter()
-
-        if selected_category == "All" or selected_category is None:
-            filtered_df = df
+    def instrumented(renderer):
+        # Metrics for the output, labelled with the current filter value (no-op unless
+        # RETAIL_METRICS=1)
+        return instrument(renderer, input.Category_filter)
+
+    filtered_view = reactive.value()
+    shown_dataset = None  # The snapshot filtered_view was resolved from
+    shown_choices = ui_choices
+    # The filter inputs, debounced: Category_filter, and Date_range with Location_filter.
+    # Each is only set when it changes, so a new category leaves the scope as it is.
+    category_filter = reactive.value()
+    scope_filter = reactive.value()
+    pending_filters = None  # Task applying the latest input values once they settle
+
+    def set_filters(category, scope):
+        with reactive.isolate():
+            if not category_filter.is_set() or category_filter() != category:
+                category_filter.set(category)
+            if not scope_filter.is_set() or scope_filter() != scope:
+                scope_filter.set(scope)
+
+    async def apply_filters(category, scope):
+        await asyncio.sleep(filter_debounce)
+        async with reactive.lock():
+            set_filters(category, scope)
+            await reactive.flush()
+
+    @reactive.effect(priority=2)
+    def _():
+        nonlocal pending_filters
+        category, scope = input.Category_filter(), (input.Date_range(), input.Location_filter())
+        if pending_filters is not None:
+            pending_filters.cancel()  # Superseded before it was applied
+            pending_filters = None
+        with reactive.isolate():
+            first = not category_filter.is_set()
+        if first or filter_debounce <= 0:
+            set_filters(category, scope)
         else:
-            filtered_df = df[df['Category'] == selected_category]
-
-        data = filtered_df.groupby(['Category', 'Payment Method'])['Total Spent'].sum().unstack(fill_value=0)
-        data = data.sort_values(by=data.columns.tolist(), ascending=False)
-
-        fig, ax = plt.subplots(figsize=(10, 5))
-        data.plot(
-            kind='bar',
-            stacked=True,
-            ax=ax,
-            color=color_palette[:len(data.columns)],
+            pending_filters = asyncio.create_task(apply_filters(category, scope))
+
+    @session.on_ended
+    def _():
+        if pending_filters is not None:
+            pending_filters.cancel()
+
+    @reactive.effect
+    def _():
+        # Pages built before the dataset was loaded, or before ingested rows brought a
+        # new category, location or day, offer fewer choices than the dataset has
+        nonlocal shown_choices
+        choices = filter_choices(loaded_dataset())
+        with reactive.isolate():
+            if choices.categories != shown_choices.categories:
+                ui.update_radio_buttons("Category_filter", choices=choices.categories, selected=input.Category_filter())
+            if choices.locations != shown_choices.locations:
+                ui.update_select("Location_filter", choices=choices.locations, selected=input.Location_filter())
+            if choices.dates != shown_choices.dates:
+                # A range covering every day keeps covering every day
+                date_range = input.Date_range()
+                if date_range is None or tuple(date_range) == shown_choices.dates:
+                    date_range = choices.dates
+                ui.update_slider("Date_range", min=choices.dates[0], max=choices.dates[1], value=date_range)
+        shown_choices = choices
+
+    @reactive.calc
+    def selection():
+        # The date range (as days) and the location to narrow the data down to, None
+        # for each that covers everything
+        date_range, location = scope_filter()
+        if background_load and date_range is not None and tuple(date_range) == ui_choices.dates:
+            date_range = None  # Still the placeholder of a page built before the data was loaded
+        return loaded_dataset().bounds.period(date_range), None if location == "All" else location
+
+    @reactive.calc
+    def summary():
+        return query_backend.summarize(loaded_dataset(), *selection())
+
+    if background_load:
+        @render.ui
+        def loading_status():
+            if current_dataset() is not None:
+                return None
+            if startup_error is not None:
+                return "The sales data could not be loaded."
+            return "Loading sales data..."
+
+    @reactive.effect(priority=1)
+    def _():
+        # Resolved once per filter or data change and shared by every output that
+        # follows the filter. Ingested rows for other categories leave the view object
+        # unchanged, and setting an identical object does not invalidate those outputs.
+        nonlocal shown_dataset
+        shown_dataset = loaded_dataset()
+        filtered_view.set(shown_dataset.view(category_filter(), *selection()))
+
+    if chunk_rows == 0:
+        @render.download_button(
+            filename=lambda: export_filename(filtered_view().selected_category, input.Export_format(), input.Export_gzip()),
+            media_type=lambda: export_media_types[input.Export_format(), input.Export_gzip()],
         )
+        async def export_rows():
+            # The rows behind the charts, with every filter applied
+            async for data in stream_export(filtered_view(), input.Export_format(), input.Export_gzip()):
+                yield data
 
-        ax.set_ylabel("Total Spent", fontsize=14)
-        ax.set_xlabel("")  # Remove x-axis label
-        # ax.legend(title="Payment Method", fontsize=10)
-        
-        # Move the legend outside the plot area
-        ax.legend(
-            title="Payment Method",
-            fontsize=10,
-            bbox_to_anchor=(1.05, 0.5),  # Move legend outside to the right
-            loc='center left',          # Anchor point for the legend
-            borderaxespad=0.           # Padding between legend and axes
-        )
-        ax.tick_params(axis='x', labelrotation=45)
-
-        # Wrap long x-axis labels
-        ax.set_xticklabels(["\n".join(label.get_text().split()) for label in ax.get_xticklabels()])
-
-        ax.grid(axis='y', linestyle='--', alpha=0.7)
-        
-        # Remove the right and top spines
-        ax.spines['right'].set_visible(False)
-        ax.spines['top'].set_visible(False)
-        fig.tight_layout()
-
-        return fig
+    @output
+    @instrumented
+    @cached_plot
+    def stacked_bar_chart():
+        return stacked_bar_request(shown_dataset, filtered_view())
 
+    @instrumented
     @render.ui
     def price():
-        # Ensure 'Total Spent' is numeric and handle missing values
-        if data['Total Spent'].isnull().any():
-            data['Total Spent'] = data['Total Spent'].fillna(0)  # Replace NaN with 0
-
-        # # Convert 'Total Spent' to numeric, replacing non-numeric values with 0
-        # data['Total Spent'] = pd.to_numeric(data['Total Spent'], errors='coerce').fillna(0)
-
-        # Calculate total spend as an integer
-        total_spend = int(data['Total Spent'].sum())
-        return f"{total_spend:,.2f} $"  # Format with commas and currency symbol
+        # Total spend as an integer, formatted with commas and currency symbol
+        return f"{int(summary().total_spend):,.2f} $"
     
+    @instrumented
     @render.ui
     def quantity():
-        # Check for missing or non-numeric values
-        if data['Quantity'].isnull().any():
-            data['Quantity'] = data['Quantity'].fillna(0)  # Replace NaN with 0
-
-        data['Quantity'] = data['Quantity'].astype(int)
-        total_quantity = data['Quantity'].sum()
-        return f"{total_quantity:,}"  # Format as currency
+        return f"{summary().total_quantity:,}"
     
+    @instrumented
     @render.ui
     def yoy():
-        # Convert 'Transaction Date' to datetime if not already done
-        if not pd.api.types.is_datetime64_any_dtype(data['Transaction Date']):
-            data['Transaction Date'] = pd.to_datetime(data['Transaction Date'])
-
-        # Extract the year from the transaction date
-        data['Year'] = data['Transaction Date'].dt.year
-
-        # Handle missing or zero values in 'Total Spent'
-        data['Total Spent'] = data['Total Spent'].fillna(0)
-
-        # Group by year and calculate the total spent for each year
-        yearly_total_spent = data.groupby('Year')['Total Spent'].sum().reset_index()
+        sales = summary()
 
         # Check if there are enough years of data for YoY analysis
-        if len(yearly_total_spent) < 2:
+        if len(sales.yearly_spend) < 2:
             return "Insufficient data for Year-over-Year analysis."
 
-        # Calculate Year-over-Year (YoY) percentage change
-        yearly_total_spent['YoY Change (%)'] = yearly_total_spent['Total Spent'].pct_change() * 100
-
-        # Extract the data for the last year
-        last_year_data = yearly_total_spent.iloc[-1]
-
         # Handle cases where YoY Change is NaN
-        last_year_yoy_change = last_year_data["YoY Change (%)"]
-        if pd.isna(last_year_yoy_change):
+        if pd.isna(sales.yoy_change):
             return "No YoY Change Available"
 
         # Format the YoY Change value to 2 decimal places
-        last_year_yoy_change = round(last_year_yoy_change, 2)
-
-        return f"{last_year_yoy_change}%"
+        return f"{round(sales.yoy_change, 2)}%"
 
 
 
     @output
+    @instrumented
     @render.table
     def top_customers():
-        # Calculate the total spend per customer
-        top_customers = data.groupby('Customer ID')['Total Spent'].sum().reset_index()
-
-        # Sort by total spend in descending order
-        top_customers = top_customers.sort_values(by='Total Spent', ascending=False).head(10)
+        # Customers with the highest total spend, already ranked in descending order
+        top_customers = loaded_dataset().customers.top().rename('Total Spent').rename_axis('Customer ID').reset_index()
 
         # # Convert 'Total Spent' to numeric, replacing non-numeric values with 0
         # top_customers['Total Spent'] = pd.to_numeric(top_customers['Total Spent'], errors='coerce').fillna(0)
@@ -335,235 +2238,49 @@ def server(input, output, session):
 #---------------------- PART2 ----------------------#
 
     @output
-    @render.plot
+    @instrumented
+    @cached_plot
     def donut_chart():
-        selected_category = input.Category_filter()
-
-        if selected_category == "All" or selected_category is None:
-            counts = df['Category'].value_counts(normalize=True) * 100
-        else:
-            filtered_df = df[df['Category'] == selected_category]
-            counts = filtered_df['Category'].value_counts(normalize=True) * 100
-
-        if counts.empty:
-            fig, ax = plt.subplots(figsize=(6, 6))
-            ax.text(0.5, 0.5, "No data available", ha="center", va="center", fontsize=12)
-            ax.set_title("Category Distribution", fontsize=14)
-            return fig
-
-        fig, ax = plt.subplots(figsize=(6, 6))
-        wedges, texts, autotexts = ax.pie(
-            counts,
-            labels=["\n".join(label.split()) for label in counts.index],  # Wrap text
-            autopct='%1.1f%%',
-            startangle=90,
-            wedgeprops={'width': 0.8},
-            colors=color_palette[:len(counts)],
-        )
-        for text in texts + autotexts:
-            text.set_fontsize(12)  # Consistent font size for labels and percentages
-        title = "Category Distribution" if selected_category == "All" else f"Category Distribution: {selected_category}"
-        ax.set_title(title, fontsize=14)  # Consistent title font size
-
-        return fig
+        return donut_request(shown_dataset, filtered_view())
 
 
     @output
-    @render.plot
+    @instrumented
+    @cached_plot
     def bar_chart_avg_price():
-        # Calculate the adjusted price per unit by dividing Price Per Unit by Quantity
-        data1['Adjusted Price Per Unit'] = data1['Price Per Unit'] / data1['Quantity']
-
-        # Group the data by 'Category' and calculate the average Price Per Unit for each category
-        category_avg_price = data1.groupby('Category')['Adjusted Price Per Unit'].mean().reset_index()
-
-        # Rename the columns for clarity
-        category_avg_price.columns = ['Category', 'Average Price Per Unit']
-
-        # Sort the DataFrame by 'Average Price Per Unit' in descending order
-        category_avg_price_sorted = category_avg_price.sort_values(by='Average Price Per Unit', ascending=False)
-
-        # Find the category with the highest value
-        max_value_category = category_avg_price_sorted.iloc[0]['Category']
-
-        # Create the plot
-        fig, ax = plt.subplots(figsize=(10, 5))
-
-        # Highlight the highest value bar
-        bars = ax.bar(
-            category_avg_price_sorted['Category'], 
-            category_avg_price_sorted['Average Price Per Unit'], 
-            color=[
-                'orange' if category == max_value_category else 'teal'
-                for category in category_avg_price_sorted['Category']
-            ],
-            width=0.5
-        )
-
-        # Add labels to each bar
-        for bar in bars:
-            height = bar.get_height()
-            ax.text(
-                bar.get_x() + bar.get_width() / 2,  # Position at the center of the bar
-                height,  # Height of the bar
-                f"{height:.2f}",  # Display the value formatted to 2 decimal places
-                ha='center', va='bottom', fontsize=10  # Consistent font size for bar labels
-            )
-
-        # Wrap long x-axis labels
-        wrapped_labels = ["\n".join(label.split()) for label in category_avg_price_sorted['Category']]
-        ax.set_xticks(range(len(wrapped_labels)))
-        ax.set_xticklabels(wrapped_labels, rotation=45, ha='right', fontsize=12)  # Consistent font size for x-axis labels
-
-        # Remove the right and top spines
-        ax.spines['right'].set_visible(False)
-        ax.spines['top'].set_visible(False)
-
-        # Chart details
-        ax.set_title('Average Price Per Unit by Category', fontsize=14, pad=20)  # Consistent title font size
-        ax.set_ylabel('Average Price Per Unit', fontsize=12)  # Consistent y-axis label font size
-        ax.tick_params(axis='y', labelsize=12)  # Consistent y-axis tick label font size
-
-        return fig
+        return avg_price_request(summary())
 
     @output
-    @render.plot
+    @instrumented
+    @cached_plot
     def bar_chart_month():
-        selected_category = input.Category_filter()
-
-        # Filter the data based on the selected category
-        if selected_category == "All" or selected_category is None:
-            filtered_df = data
-        else:
-            filtered_df = data[data['Category'] == selected_category]
-
-        filtered_df['Transaction Date'] = pd.to_datetime(filtered_df['Transaction Date'])
-        filtered_df['Month Name'] = filtered_df['Transaction Date'].dt.month_name()
-
-        month_total_spent = filtered_df.groupby('Month Name')['Total Spent'].sum().reset_index()
-
-        # Ensure months are in the correct order
-        month_order = ['January', 'February', 'March', 'April', 'May', 'June',
-                    'July', 'August', 'September', 'October', 'November', 'December']
-        month_total_spent['Month Name'] = pd.Categorical(month_total_spent['Month Name'], categories=month_order, ordered=True)
-        month_total_spent = month_total_spent.sort_values('Month Name')
-
-        if month_total_spent.empty:
-            fig, ax = plt.subplots(figsize=(10, 5))
-            ax.text(0.5, 0.5, "No data available", ha="center", va="center", fontsize=12)
-            ax.set_title("Total Spent by Month", fontsize=14)
-            return fig
-
-        # Calculate the shared maximum for the y-axis
-        shared_max = calculate_dynamic_shared_max(filtered_df)
-
-        # Find the month with the maximum total spent
-        max_value_month = month_total_spent.loc[month_total_spent['Total Spent'].idxmax(), 'Month Name']
-
-        # Create the plot
-        fig, ax = plt.subplots(figsize=(10, 5))
-        bars = ax.bar(
-            month_total_spent['Month Name'],
-            month_total_spent['Total Spent'],
-            color=[
-                'orange' if month == max_value_month else '#48A6A7'
-                for month in month_total_spent['Month Name']
-            ],
-        )
-
-        # Add labels to each bar
-        for bar in bars:
-            height = bar.get_height()
-            ax.text(
-                bar.get_x() + bar.get_width() / 2,  # Position at the center of the bar
-                height + (shared_max * 0.02),  # Move label slightly above the bar
-                f"{height:,.0f}",  # Display the value formatted with commas
-                ha='center', va='bottom', fontsize=8  # Adjust font size and alignment
-            )
-
-        # Set the y-axis limit using the shared maximum
-        ax.set_ylim(0, shared_max * 1.15)  # Add extra padding for labels
-
-        # Chart details
-        ax.set_title('Total Spent by Month', fontsize=14)  # Consistent title font size
-        ax.set_ylabel('Total Spent', fontsize=12)  # Consistent y-axis label font size
-        ax.tick_params(axis='x', labelrotation=45, labelsize=12)  # Consistent x-axis tick label font size
-        ax.tick_params(axis='y', labelsize=12)  # Consistent y-axis tick label font size
-
-        # Remove the right and top spines
-        ax.spines['right'].set_visible(False)
-        ax.spines['top'].set_visible(False)
-
-        fig.tight_layout()
-
-        return fig
+        return month_request(shown_dataset, filtered_view())
 
     @output
-    @render.plot
+    @instrumented
+    @cached_plot
     def bar_chart_day():
-        selected_category = input.Category_filter()
-
-        # Filter the data based on the selected category
-        if selected_category == "All" or selected_category is None:
-            filtered_df = data
-        else:
-            filtered_df = data[data['Category'] == selected_category]
-
-        filtered_df['Transaction Date'] = pd.to_datetime(filtered_df['Transaction Date'])
-        filtered_df['Day Name'] = filtered_df['Transaction Date'].dt.day_name()
-
-        day_total_spent = filtered_df.groupby('Day Name')['Total Spent'].sum().reset_index()
-
-        # Ensure days are in the correct order
-        day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        day_total_spent['Day Name'] = pd.Categorical(day_total_spent['Day Name'], categories=day_order, ordered=True)
-        day_total_spent = day_total_spent.sort_values('Day Name')
-
-        if day_total_spent.empty:
-            fig, ax = plt.subplots(figsize=(10, 5))
-            ax.text(0.5, 0.5, "No data available", ha="center", va="center", fontsize=12)
-            ax.set_title("Total Spent by Day of the Week", fontsize=14)
-            return fig
-
-        # Calculate the shared maximum for the y-axis
-        shared_max = calculate_dynamic_shared_max(filtered_df)
-
-        # Find the day with the maximum total spent
-        max_value_day = day_total_spent.loc[day_total_spent['Total Spent'].idxmax(), 'Day Name']
-
-        # Create the plot
-        fig, ax = plt.subplots(figsize=(10, 5))
-        bars = ax.bar(
-            day_total_spent['Day Name'],
-            day_total_spent['Total Spent'],
-            color=[
-                'orange' if day == max_value_day else '#9ACBD0'
-                for day in day_total_spent['Day Name']
-            ],
-            width=0.5
-        )
-
-        # Add labels to each bar
-        for bar in bars:
-            height = bar.get_height()
-            ax.text(bar.get_x() + bar.get_width() / 2, height, f"{height:,.0f}", ha='center', va='bottom', fontsize=8)  # Consistent font size for bar labels
-
-        # Set the y-axis limit using the shared maximum
-        ax.set_ylim(0, shared_max * 1.1)  # Add 10% padding
-
-        # Chart details
-        ax.set_title('Total Spent by Day of the Week', fontsize=14, pad=20)  # Consistent title font size
-        ax.set_ylabel('Total Spent', fontsize=12)  # Consistent y-axis label font size
-        ax.tick_params(axis='x', labelrotation=45, labelsize=12)  # Consistent x-axis tick label font size
-        ax.tick_params(axis='y', labelsize=12)  # Consistent y-axis tick label font size
-
-        # Remove the right and top spines
-        ax.spines['right'].set_visible(False)
-        ax.spines['top'].set_visible(False)
-
-        fig.tight_layout()
-
-        return fig
+        return day_request(shown_dataset, filtered_view())
 
 # Create the Shiny app
 app = App(app_ui, server)
+app.on_shutdown(shutdown_plot_workers)
+
+# Served by the app's own router, next to the Shiny routes
+app.starlette_app.router.routes.insert(0, Route("/healthz", liveness_endpoint))
+app.starlette_app.router.routes.insert(0, Route("/readyz", readiness_endpoint))
+if metrics_enabled:
+    app.starlette_app.router.routes.insert(0, Route("/metrics", metrics_endpoint))
+
+if background_load:
+    loader = threading.Thread(target=load_in_background, name="dataset-loader", daemon=True)
+    loader.start()
+
+if __name__ == '__main__':
+    # Importing the app loads the dataset, so running this script builds the dataset
+    # store once, e.g. before starting several workers
+    if background_load:
+        loader.join()
+    if startup_error is not None:
+        sys.exit(f"Could not load the dataset: {startup_error}")
+    print(f"Dataset store ready in {cache_dir}")
@@ -0,0 +1,363 @@
+# Load test for retail_store_dashboard.py with many simultaneous sessions. It starts
+# the app with uvicorn on localhost and opens simulated browser sessions over the
+# app's websocket. Every session replays a filter-change script: it picks another
+# category, location or date range, waits until the outputs that depend on it have
+# arrived, then pauses for a think time before the next change. The session count is
+# stepped up, and for every step the report gives end-to-end update latency
+# percentiles, updates per second, event-loop lag and memory of every worker:
+#
+#   python retail_store_loadtest.py --rows 100000 --sessions 1 10 25 50 --duration 30
+#   python retail_store_loadtest.py --csv retail_store_sales.csv --workers 4 --output load.json
+#
+# Everything runs offline: the data is synthetic (see retail_store_benchmark.py) unless
+# --csv is given, and all traffic stays on 127.0.0.1. RETAIL_* variables set when the
+# harness starts are passed on to the app, e.g. RETAIL_PLOT_PROCESSES=4. The simulated
+# sessions run in this process and share the machine with the app, so keep an eye on
+# the harness's own CPU use at high session counts.
+from websockets.asyncio.client import connect
+import numpy as np
+import argparse
+import asyncio
+import datetime
+import html
+import json
+import os
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from retail_store_benchmark import environment, outputs, peak_rss_bytes, summarize, synthetic_csv
+
+# Outputs that change with each kind of filter change
+category_outputs = {"stacked_bar_chart", "donut_chart", "bar_chart_month", "bar_chart_day"}
+scope_outputs = category_outputs | {"price", "quantity", "yoy", "bar_chart_avg_price"}
+
+#-------- App server --------#
+
+# The app runs in its own process (see start_server), with the event loop of every
+# worker sampled: a task sleeping lag_interval seconds at a time records how much later
+# than that it wakes up. Samples and the worker's memory are appended to one file per
+# worker, which the harness reads after every step.
+lag_interval = 0.05
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:  # Linux
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return peak_rss_bytes()
+
+async def sample_loop_lag(path):
+    pending = []
+    last_write = time.time()
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(lag_interval)
+        pending.append(f"{time.time():.3f} {time.perf_counter() - start - lag_interval:.6f} {current_rss_bytes()}\n")
+        if time.time() - last_write >= 1:
+            with open(path, "a") as f:
+                f.writelines(pending)
+            pending.clear()
+            last_write = time.time()
+
+class SampledApp:
+    # The dashboard's app, sampling the event loop from the first request (uvicorn's
+    # lifespan startup) on
+    def __init__(self, app, stats_dir):
+        self.app = app
+        self.path = os.path.join(stats_dir, f"{os.getpid()}.log")
+        self.sampler = None
+
+    async def __call__(self, scope, receive, send):
+        if self.sampler is None:
+            self.sampler = asyncio.get_running_loop().create_task(sample_loop_lag(self.path))
+        await self.app(scope, receive, send)
+
+def create_app():
+    # Called by uvicorn in every worker; importing the dashboard loads the dataset
+    from retail_store_dashboard import app
+    return SampledApp(app, os.environ["RETAIL_LOADTEST_STATS"])
+
+def serve(args):
+    import uvicorn
+    uvicorn.run(
+        "retail_store_loadtest:create_app", factory=True, app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host="127.0.0.1", port=args.port, workers=args.workers, log_level="warning",
+    )
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(csv, workers, stats_dir, timeout):
+    port = free_port()
+    env = {**os.environ, "RETAIL_SALES_CSV": csv, "RETAIL_LOADTEST_STATS": stats_dir}
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port), "--workers", str(workers)], env=env,
+        start_new_session=True,  # Own process group, so stop_server can kill what is left
+    )
+
+    # Ready once every worker samples its event loop and the app reports ready
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            stop_server(server)
+            sys.exit(f"The app exited with code {server.returncode} before it was ready")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/readyz", timeout=5) as response:
+                ready = response.status == 200
+        except (OSError, urllib.error.URLError):
+            ready = False
+        if ready and len(os.listdir(stats_dir)) >= workers:
+            return server, port
+        time.sleep(0.5)
+    stop_server(server)
+    sys.exit(f"The app was not ready within {timeout}s")
+
+def stop_server(server):
+    # uvicorn stops its workers, which shut the app down; anything left after that is
+    # killed
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        os.killpg(server.pid, signal.SIGKILL)
+    except ProcessLookupError:  # Exited with everything it started
+        pass
+    server.wait()
+
+def worker_stats(stats_dir, start, end):
+    # Event-loop lag and memory of every worker between start and end (epoch seconds)
+    lag, workers = [], []
+    for name in sorted(os.listdir(stats_dir)):
+        samples = np.loadtxt(os.path.join(stats_dir, name), ndmin=2)
+        samples = samples[(samples[:, 0] >= start) & (samples[:, 0] <= end)] if len(samples) else samples
+        if len(samples) == 0:
+            continue
+        lag.append(samples[:, 1])
+        workers.append({"pid": int(name.split(".")[0]), "rss_bytes": int(samples[-1, 2]), "peak_rss_bytes": int(samples[:, 2].max())})
+    lag = np.concatenate(lag) if lag else np.array([0.0])
+    return summarize(lag), workers
+
+#-------- Simulated sessions --------#
+
+class Choices:
+    # Filter values offered by the page: categories and locations besides "All", and
+    # the first and last day of the date slider
+    def __init__(self, categories, locations, first_day, last_day):
+        self.categories, self.locations = categories, locations
+        self.first_day, self.last_day = first_day, last_day
+
+def slider_day(milliseconds):
+    return datetime.date(1970, 1, 1) + datetime.timedelta(milliseconds=float(milliseconds))
+
+def parse_choices(markup, choices):
+    # Reads the choices from the page, or from the updates sessions get when the page
+    # was built before the dataset was loaded
+    categories = [html.unescape(value) for value in re.findall(r'name="Category_filter" value="([^"]*)"', markup)]
+    select = re.search(r'<select[^>]*id="Location_filter"[^>]*>(.*?)</select>', markup, re.S)
+    slider = re.search(r'id="Date_range"[^>]*', markup)
+    if categories:
+        choices.categories = [category for category in categories if category != "All"]
+    if select:
+        locations = [html.unescape(value) for value in re.findall(r'<option value="([^"]*)"', select.group(1))]
+        choices.locations = [location for location in locations if location != "All"]
+    if slider:
+        bounds = dict(re.findall(r'data-(min|max)="([^"]*)"', slider.group(0)))
+        choices.first_day, choices.last_day = slider_day(bounds["min"]), slider_day(bounds["max"])
+    return choices
+
+def init_message(width, height):
+    data = {
+        "Category_filter": "All",
+        "Location_filter": "All",
+        "Date_range:shiny.date": ["1970-01-01", "2999-12-31"],  # Every day
+        "Export_format": "csv",
+        "Export_gzip": False,
+        ".clientdata_pixelratio": 1,
+        ".clientdata_url_search": "",
+    }
+    for name in outputs:
+        data[f".clientdata_output_{name}_width"] = width
+        data[f".clientdata_output_{name}_height"] = height
+        data[f".clientdata_output_{name}_hidden"] = False
+    return json.dumps({"method": "init", "data": data})
+
+async def receive_outputs(ws, expected, timeout, choices=None):
+    # Waits until every expected output got a value (or an error); returns the number
+    # of errors. Input updates for the filters are parsed into choices when given.
+    received, errors = set(), 0
+    async with asyncio.timeout(timeout):
+        while not expected <= received:
+            message = json.loads(await ws.recv())
+            received |= set(message.get("values", {}))
+            received |= set(message.get("errors", {}))
+            errors += len(message.get("errors", {}))
+            if choices is not None:
+                for update in message.get("inputMessages", []):
+                    if update["id"] == "Category_filter" and "options" in update["message"]:
+                        parse_choices(update["message"]["options"], choices)
+                    elif update["id"] == "Location_filter" and "options" in update["message"]:
+                        locations = re.findall(r'<option value="([^"]*)"', update["message"]["options"])
+                        choices.locations = [html.unescape(value) for value in locations if value != "All"]
+                    elif update["id"] == "Date_range" and "min" in update["message"]:
+                        choices.first_day = slider_day(update["message"]["min"])
+                        choices.last_day = slider_day(update["message"]["max"])
+    return errors
+
+async def discover_choices(port, args):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=30) as response:
+        choices = parse_choices(response.read().decode(), Choices([], [], None, None))
+    async with connect(f"ws://127.0.0.1:{port}/websocket/", max_size=None) as ws:
+        await ws.send(init_message(args.width, args.height))
+        await receive_outputs(ws, set(outputs), args.timeout, choices)
+    return choices
+
+def next_change(rng, state, choices):
+    # One filter change of a user exploring the data: mostly another category,
+    # sometimes another location or date range
+    kind = rng.choice(["category", "location", "dates"], p=[0.6, 0.2, 0.2])
+    if kind == "location" and choices.locations:
+        options = [location for location in ["All"] + choices.locations if location != state["Location_filter"]]
+        return {"Location_filter": str(rng.choice(options))}, scope_outputs
+    if kind == "dates" and choices.first_day is not None:
+        days = (choices.last_day - choices.first_day).days
+        start, end = sorted(rng.integers(0, days + 1, 2))
+        dates = [str(choices.first_day + datetime.timedelta(days=int(day))) for day in (start, end)]
+        return {"Date_range:shiny.date": dates}, scope_outputs
+    options = [category for category in ["All"] + choices.categories if category != state["Category_filter"]]
+    return {"Category_filter": str(rng.choice(options))}, category_outputs
+
+async def run_session(number, port, choices, args, stop_at, results):
+    rng = np.random.default_rng([args.seed, number])
+    await asyncio.sleep(rng.uniform(0, args.ramp))  # Sessions do not all start at once
+    state = {"Category_filter": "All", "Location_filter": "All"}
+    try:
+        async with connect(f"ws://127.0.0.1:{port}/websocket/", max_size=None) as ws:
+            start = time.perf_counter()
+            await ws.send(init_message(args.width, args.height))
+            results["errors"] += await receive_outputs(ws, set(outputs), args.timeout)
+            results["initial"].append(time.perf_counter() - start)
+
+            while True:
+                await asyncio.sleep(rng.exponential(args.think))
+                if time.monotonic() >= stop_at:
+                    return
+                change, expected = next_change(rng, state, choices)
+                state.update(change)
+                start = time.perf_counter()
+                await ws.send(json.dumps({"method": "update", "data": change}))
+                results["errors"] += await receive_outputs(ws, expected, args.timeout)
+                results["updates"].append(time.perf_counter() - start)
+    except (TimeoutError, OSError) as error:
+        results["failures"].append(f"session {number}: {type(error).__name__} {error}")
+
+async def run_step(port, choices, sessions, args):
+    results = {"initial": [], "updates": [], "errors": 0, "failures": []}
+    stop_at = time.monotonic() + args.ramp + args.duration
+    await asyncio.gather(*(run_session(n, port, choices, args, stop_at, results) for n in range(sessions)))
+    return results
+
+#-------- Reports --------#
+
+def print_header():
+    print(f"\n{'sessions':>8} {'updates/s':>10} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'first ms':>9} {'errors':>7} {'lag p99':>8} {'lag max':>8}  worker RSS MB")
+
+def print_step(step):
+    updates, lag = step["updates"], step["loop_lag"]
+    rss = " ".join(f"{worker['rss_bytes'] / 2**20:,.0f}" for worker in step["workers"])
+    if updates:
+        latency = (f"{updates['p50_ms']:>8.0f} {updates['p90_ms']:>8.0f} "
+                   f"{updates['p99_ms']:>8.0f} {updates['max_ms']:>8.0f}")
+    else:
+        latency = f"{'-':>8} {'-':>8} {'-':>8} {'-':>8}"
+    first = f"{step['initial']['p50_ms']:>9.0f}" if step["initial"] else f"{'-':>9}"
+    print(f"{step['sessions']:>8} {step['throughput']:>10.1f} {latency} {first} "
+          f"{step['errors'] + len(step['failures']):>7} {lag['p99_ms']:>8.0f} {lag['max_ms']:>8.0f}  {rss}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the retail store dashboard with concurrent sessions")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 10, 25, 50],
+                        help="concurrent session counts, one step each")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of filter changes per step")
+    parser.add_argument("--ramp", type=float, default=2, help="seconds over which the sessions of a step start")
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds between a session's filter changes")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--rows", type=int, default=100_000, help="synthetic dataset size")
+    parser.add_argument("--csv", help="serve this CSV instead of synthetic data")
+    parser.add_argument("--customers", type=int, default=25, help="distinct customers in synthetic data")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default="benchmark_data", help="where synthetic CSVs are kept")
+    parser.add_argument("--width", type=int, default=600)
+    parser.add_argument("--height", type=int, default=400)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the outputs of an update")
+    parser.add_argument("--startup-timeout", type=float, default=600, help="seconds to wait for the app to be ready")
+    parser.add_argument("--slo-ms", type=float, default=1000, help="p90 update latency counted as degraded")
+    parser.add_argument("--output", help="save results as JSON")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    csv = args.csv or synthetic_csv(args.data_dir, args.rows, args.customers, args.seed)
+    stats_dir = tempfile.mkdtemp(prefix="retail_loadtest_")
+    report = {"environment": environment(), "settings": vars(args), "csv": csv, "steps": []}
+    server, port = start_server(csv, args.workers, stats_dir, args.startup_timeout)
+    try:
+        choices = asyncio.run(discover_choices(port, args))
+        print(f"{csv}: {args.workers} worker(s), {len(choices.categories)} categories, "
+              f"{len(choices.locations)} locations, {choices.first_day} to {choices.last_day}")
+        print_header()
+        for sessions in args.sessions:
+            start = time.time()
+            results = asyncio.run(run_step(port, choices, sessions, args))
+            end = time.time()
+            loop_lag, workers = worker_stats(stats_dir, start, end)
+            step = {
+                "sessions": sessions,
+                "seconds": end - start,
+                "throughput": len(results["updates"]) / (end - start),
+                "updates": summarize(results["updates"]) if results["updates"] else None,
+                "initial": summarize(results["initial"]) if results["initial"] else None,
+                "errors": results["errors"],
+                "failures": results["failures"],
+                "loop_lag": loop_lag,
+                "workers": workers,
+            }
+            report["steps"].append(step)
+            print_step(step)
+            for failure in results["failures"][:5]:
+                print(f"  {failure}")
+    finally:
+        stop_server(server)
+        shutil.rmtree(stats_dir, ignore_errors=True)
+
+    degraded = [
+        step["sessions"] for step in report["steps"]
+        if step["failures"] or not step["updates"] or step["updates"]["p90_ms"] > args.slo_ms
+    ]
+    if degraded:
+        print(f"\nDegraded from {degraded[0]} sessions on (p90 above {args.slo_ms:.0f} ms, or failed sessions)")
+    else:
+        print(f"\nNo step degraded (p90 within {args.slo_ms:.0f} ms)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()